@@ -1,6 +1,7 @@
+from datetime import datetime
 from typing import Protocol, Union
 
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.admin import FieldListFilter, RelatedFieldListFilter
 from django.contrib.auth.models import User
 from django.db.models import QuerySet, Model, Q
@@ -8,6 +9,7 @@ from django import forms
 from django.http import HttpRequest
 
 from . import models
+from .uploads import add_images
 
 
 class HasUser(Protocol):
@@ -70,27 +72,36 @@ class CategoryForm(forms.ModelForm):
 		label="Add images",
 		required=False,
 	)
+	prerender_thumbnails = forms.BooleanField(
+		label="Create thumbnails of added images in the background",
+		required=False,
+	)
 
-	def save_images(self, request: HasUser, category: models.Category):
-		"""Process each uploaded image."""
-		for upload in self.files.getlist("images"):
-			image = models.Image(category=category, file=upload, owner=request.user)
-			image.save()
-
+	def save_images(self, request: Union[HttpRequest, HasUser], category: models.Category):
+		"""Add the uploaded images in bulk, and report the ones that failed."""
+		uploads = self.files.getlist("images")
+		if not uploads:
+			return
+		result = add_images(category, uploads, owner=request.user,
+			prerender=self.cleaned_data.get('prerender_thumbnails', False))
+		if result.images:
+			messages.success(request, 'Added {} images.'.format(len(result.images)))
+		for name, error in result.failures:
+			messages.error(request, 'Cannot add image {}: {}'.format(name, error))
 
 
 class ThumbnailFormatAdmin(admin.ModelAdmin):
 	model = models.ThumbnailFormat
-	list_display = ('width', 'height', 'crop')
-	fields = ('width', 'height', 'crop')
+	list_display = ('width', 'height', 'crop', 'quality', 'progressive')
+	fields = ('width', 'height', 'crop', 'quality', 'progressive', 'optimize', 'subsampling', 'strip_metadata')
 	ordering = ('width', 'height', 'crop')
 
 
 class CategoryAdmin(_OwnerMixin, admin.ModelAdmin):
 	model = models.Category
 	fields = ['parent', 'title', 'description', 'slug', 'default_thumbnail_format', 'display_formats', 'owner',
-		'default_image', 'hidden', 'private', 'sequence', 'images']
-	list_display = ('title', 'parent', 'slug', 'created_at', 'updated_at')
+		'default_image', 'hidden', 'private', 'sequence', 'page_size', 'images', 'prerender_thumbnails']
+	list_display = ('title', 'parent', 'slug', 'total_image_count', 'created_at', 'updated_at')
 	ordering = ('-parent', 'sequence', )
 	list_filter = ('parent',)
 	search_fields = ('title',)
@@ -129,7 +140,26 @@ class ImageAdmin(_OwnerMixin, admin.ModelAdmin):
 	search_fields = ('title',)
 
 
+class JobAdmin(admin.ModelAdmin):
+	model = models.Job
+	list_display = ('__str__', 'state', 'attempts', 'created_at', 'finished_at', 'duration')
+	list_filter = ('state', 'name')
+	readonly_fields = ('name', 'kwargs', 'state', 'attempts', 'max_attempts', 'run_after', 'worker', 'error',
+		'created_at', 'started_at', 'finished_at', 'duration')
+	ordering = ('-id',)
+	actions = ['retry']
+
+	@admin.action(description='Retry selected jobs')
+	def retry(self, request, queryset: QuerySet):
+		queryset.exclude(state=models.Job.RUNNING).update(state=models.Job.QUEUED, attempts=0,
+			run_after=datetime.now())
+
+	def has_add_permission(self, request):
+		return False
+
+
 admin.site.register(models.ThumbnailFormat, ThumbnailFormatAdmin)
 admin.site.register(models.Category, CategoryAdmin)
 admin.site.register(models.Image, ImageAdmin)
+admin.site.register(models.Job, JobAdmin)
 
@@ -0,0 +1,337 @@
+"""
+	JSON API views.
+"""
+from functools import partial
+from typing import Any, Dict, FrozenSet, Optional
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+
+from . import models
+from .domain.category import get_default_thumbnail_format, get_thumbnail_formats, is_private
+from .domain.image import Size, get_thumbnail_size
+from .domain.url import get_url_by_category, get_url_by_image, get_thumbnail_url, get_size_str
+from .loaders import Cursor, load_category_page, load_image_neighbours
+from .uploads import UploadConflict, UploadError, abort_upload, finalize_upload, receive_chunk, start_upload
+from .views import HttpRequest, conditional_response, filter_categories
+
+_BLOCK_SIZE = 64 * 1024
+
+# fields of the categories and images in responses, to select from by the `category_fields' and
+# `image_fields' parameters
+CATEGORY_FIELDS = frozenset(('id', 'path', 'title', 'description', 'url', 'api_url', 'parent', 'views',
+	'image_count', 'total_image_count', 'created_at', 'updated_at', 'cover'))
+IMAGE_FIELDS = frozenset(('id', 'slug', 'title', 'description', 'url', 'api_url', 'category', 'width', 'height',
+	'views', 'created_at', 'updated_at', 'thumbnails', 'navigation'))
+
+
+@require_GET
+def categories(request: HttpRequest) -> HttpResponse:
+	""" The albums of the index, with the url and size of the thumbnail of their cover image. """
+	try:
+		category_fields = _get_fields(request, 'category_fields', CATEGORY_FIELDS)
+	except ValueError as e:
+		return _error(str(e))
+	# listed like by the views
+	categories = list(filter_categories(models.Category.objects.all(), request.user).filter(parent=None)
+		.select_related('effective_thumbnail_format', 'cover_image__category').order_by('-created_at'))
+	data = dict(categories=[_get_category_dict(category, category_fields, get_default_thumbnail_format(category))
+		for category in categories])
+	return conditional_response(
+		request, 'api',
+		private=not request.user.is_anonymous,
+		last_modified=max((category.updated_at for category in categories), default=None),
+		etag_parts=[request.user.pk, data],
+		render_response=lambda: JsonResponse(data)
+	)
+
+
+@require_GET
+def category(request: HttpRequest, path: str) -> HttpResponse:
+	"""
+		The album with the path (like in its url), with a page of its images and, on the first page,
+		its sub-albums. Pages follow each other by the `after' and `before' parameters, as in the
+		`next' and `previous' urls. The fields of the albums and images can be selected by the comma
+		separated `category_fields' and `image_fields' parameters.
+	"""
+	category = models.Category.objects.filter(path=path.strip('/')).first()
+	if not category:
+		return _error('Category not found', 404)
+	if owner := is_private(category):
+		if owner != request.user:
+			return _error('No access', 403)
+	try:
+		category_fields = _get_fields(request, 'category_fields', CATEGORY_FIELDS)
+		image_fields = _get_fields(request, 'image_fields', IMAGE_FIELDS)
+	except ValueError as e:
+		return _error(str(e))
+	try:
+		after, before = (Cursor.from_str(request.GET[key]) if key in request.GET else None for key in ('after', 'before'))
+	except ValueError:
+		return _error('Invalid cursor')
+	if after and before:
+		return _error('Either after or before can be given')
+
+	page = load_category_page(category, filter_categories(category.children.all(), request.user),
+		page_size=category.page_size or settings.CATEGORY_PAGE_SIZE, after=after, before=before)
+	if (after or before) and not page.images:
+		return _error('Page not found', 404)
+	# formats shared by the images, and the own formats of those having any
+	prefetch_related_objects([category], 'effective_display_formats', 'effective_thumbnail_formats')
+	prefetch_related_objects([image for image in page.images if image.has_display_formats], 'display_formats')
+	for child in page.children:
+		child.cover_image = page.covers.get(child.id)
+
+	default_thumbnail_format = get_default_thumbnail_format(category)
+	data = dict(
+		category=_get_category_dict(category, category_fields),
+		children=[_get_category_dict(child, category_fields, default_thumbnail_format) for child in page.children],
+		images=[_get_image_dict(image, image_fields) for image in page.images],
+		previous=(_get_page_url(request, category) if page.previous_is_first
+			else _get_page_url(request, category, before=page.previous)) if page.previous else None,
+		next=_get_page_url(request, category, after=page.next) if page.next else None,
+	)
+	models_shown = [category, *page.children, *page.covers.values(), *page.images]
+	return conditional_response(
+		request, 'api',
+		private=bool(owner) or not request.user.is_anonymous,
+		last_modified=max(model.updated_at for model in models_shown),
+		etag_parts=[request.user.pk, data],
+		render_response=lambda: JsonResponse(data)
+	)
+
+
+@require_GET
+def image(request: HttpRequest, path: str) -> HttpResponse:
+	"""
+		The image with the path of its album and its slug (like in its url, without .html), with the
+		urls of the first, previous, next and last image of the album as `navigation'.
+		Views are only counted by the pages of images. The fields can be selected by the comma separated
+		`image_fields' parameter.
+	"""
+	category_path, _, slug = path.strip('/').rpartition('/')
+	category = models.Category.objects.filter(path=category_path).first()
+	if not category:
+		return _error('Category not found', 404)
+	try:
+		image = models.Image.objects.get(category=category, slug=slug)
+	except models.Image.DoesNotExist:
+		return _error('Image not found', 404)
+	image.category = category
+	if owner := is_private(category):
+		if owner != request.user:
+			return _error('No access', 403)
+	try:
+		image_fields = _get_fields(request, 'image_fields', IMAGE_FIELDS)
+	except ValueError as e:
+		return _error(str(e))
+
+	neighbours = load_image_neighbours(image) if _is_selected('navigation', image_fields) else None
+	data = _get_image_dict(image, image_fields, neighbours)
+	return conditional_response(
+		request, 'api',
+		private=bool(owner),
+		last_modified=max(image.updated_at, category.updated_at),
+		etag_parts=[data],
+		render_response=lambda: JsonResponse(data)
+	)
+
+
+@require_POST
+def uploads(request: HttpRequest) -> HttpResponse:
+	"""
+		Start a chunked upload of an image, with POST parameters `category' (id), `filename' and `size'
+		(in bytes). Then PUT the chunks to the url of the upload, each with an Upload-Offset header
+		having the number of bytes sent before, and POST to its finalize url to create the image.
+		After an interrupted chunk, GET the upload to resume from the offset received.
+	"""
+	if not request.user.is_staff:
+		return _error('Login required', 403)
+	try:
+		category = models.Category.objects.get(pk=int(request.POST['category']))
+		filename = request.POST['filename']
+		size = int(request.POST['size'])
+	except (KeyError, ValueError):
+		return _error('Parameters category, filename and size required')
+	except models.Category.DoesNotExist:
+		return _error('Category not found', 404)
+	if not request.user.is_superuser and category.owner_id != request.user.pk:
+		return _error('No access', 403)
+	try:
+		upload = start_upload(category, request.user, filename, size)
+	except UploadError as e:
+		return _error(str(e))
+	response = JsonResponse(_get_upload_dict(upload), status=201)
+	response['Location'] = '/api/uploads/{}'.format(upload.id)
+	return response
+
+
+@require_http_methods(['GET', 'HEAD', 'PUT', 'DELETE'])
+def upload(request: HttpRequest, upload_id) -> HttpResponse:
+	upload = _get_upload(request, upload_id)
+	if request.method == 'PUT':
+		try:
+			offset = int(request.headers['Upload-Offset'])
+		except (KeyError, ValueError):
+			return _error('Upload-Offset header required')
+		try:
+			# stream the body, instead of having it read in memory first
+			receive_chunk(upload, offset, iter(partial(request.read, _BLOCK_SIZE), b''))
+		except UploadConflict as e:
+			return _error(str(e), 409, offset=upload.offset)
+		except UploadError as e:
+			return _error(str(e), offset=upload.offset)
+	elif request.method == 'DELETE':
+		try:
+			abort_upload(upload)
+		except UploadConflict as e:
+			return _error(str(e), 409)
+		return HttpResponse(status=204)
+	return JsonResponse(_get_upload_dict(upload))
+
+
+@require_POST
+def upload_finalize(request: HttpRequest, upload_id) -> HttpResponse:
+	""" Create the image of a complete upload, verifying the optional POST parameter `sha256'. """
+	upload = _get_upload(request, upload_id)
+	try:
+		image, sha256 = finalize_upload(upload, request.POST.get('sha256'))
+	except UploadConflict as e:
+		return _error(str(e), 409)
+	except UploadError as e:
+		return _error(str(e))
+	return JsonResponse(dict(
+		id=image.id,
+		url=get_url_by_image(image),
+		width=image.width,
+		height=image.height,
+		sha256=sha256,
+	), status=201)
+
+
+def _get_upload(request: HttpRequest, upload_id) -> models.Upload:
+	if not request.user.is_staff:
+		raise Http404('Upload not found')
+	try:
+		return models.Upload.objects.get(pk=upload_id, owner=request.user)
+	except models.Upload.DoesNotExist:
+		raise Http404('Upload not found')
+
+
+def _get_upload_dict(upload: models.Upload) -> Dict:
+	return dict(
+		id=str(upload.id),
+		filename=upload.filename,
+		size=upload.size,
+		offset=upload.offset,
+		width=upload.width,
+		height=upload.height,
+	)
+
+
+def _get_fields(request: HttpRequest, param: str, allowed: FrozenSet[str]) -> Optional[FrozenSet[str]]:
+	"""
+		Fields selected by the comma separated parameter, None for all.
+		:raises ValueError if a field is not one of allowed
+	"""
+	if param not in request.GET:
+		return None
+	fields = frozenset(field.strip() for field in request.GET[param].split(',') if field.strip())
+	if unknown := fields - allowed:
+		raise ValueError('Unknown {}: {}'.format(param, ', '.join(sorted(unknown))))
+	return fields
+
+
+def _is_selected(field: str, fields: Optional[FrozenSet[str]]) -> bool:
+	return fields is None or field in fields
+
+
+def _select(values: Dict[str, Any], fields: Optional[FrozenSet[str]]) -> Dict[str, Any]:
+	return values if fields is None else {field: value for field, value in values.items() if field in fields}
+
+
+def _get_category_api_url(category: models.Category) -> str:
+	return '/api/categories/' + category.path
+
+
+def _get_parent_api_url(category: models.Category) -> str:
+	""" Url of the parent of the category, or of the index, by its path without loading the parent """
+	parent_path = category.path.rpartition('/')[0]
+	return '/api/categories/' + parent_path if parent_path else '/api/categories'
+
+
+def _get_image_api_url(image: models.Image) -> str:
+	return '/api/images/{}/{}'.format(image.category.path, image.slug)
+
+
+def _get_page_url(request: HttpRequest, category: models.Category, **cursor: Cursor) -> str:
+	""" Url of the page of the category at the cursor, the first page without one, keeping the fields selected """
+	params = dict(((key, str(value)) for key, value in cursor.items()),
+		**{param: request.GET[param] for param in ('category_fields', 'image_fields') if param in request.GET})
+	url = _get_category_api_url(category)
+	return '{}?{}'.format(url, urlencode(params)) if params else url
+
+
+def _get_thumbnail_dict(image: models.Image, thumbnail_format: models.ThumbnailFormat) -> Dict[str, Any]:
+	""" Url and size of the thumbnail of the image, the size being unknown (None) until the image is measured """
+	size = get_thumbnail_size(Size(image.width, image.height), Size(thumbnail_format.width, thumbnail_format.height),
+		thumbnail_format.crop) if image.width and image.height else Size(None, None)
+	return dict(
+		format=get_size_str(thumbnail_format),
+		url=get_thumbnail_url(image, thumbnail_format),
+		width=size.x,
+		height=size.y,
+	)
+
+
+def _get_category_dict(category: models.Category, fields: Optional[FrozenSet[str]],
+		thumbnail_format: Optional[models.ThumbnailFormat] = None) -> Dict[str, Any]:
+	""" :param thumbnail_format: format of the thumbnail of the cover image shown, no cover if None """
+	return _select(dict(
+		id=category.id,
+		path=category.path,
+		title=category.title,
+		description=category.description,
+		url=get_url_by_category(category),
+		api_url=_get_category_api_url(category),
+		parent=_get_parent_api_url(category),
+		views=category.views,
+		image_count=category.image_count,
+		total_image_count=category.total_image_count,
+		created_at=category.created_at,
+		updated_at=category.updated_at,
+		cover=_get_thumbnail_dict(category.cover_image, thumbnail_format)
+			if thumbnail_format and category.cover_image_id and category.cover_image else None,
+	), fields)
+
+
+def _get_image_dict(image: models.Image, fields: Optional[FrozenSet[str]], neighbours=None) -> Dict[str, Any]:
+	""" :param neighbours: loaders.ImageNeighbours of the image, to add as `navigation' """
+	values = dict(
+		id=image.id,
+		slug=image.slug,
+		title=image.title,
+		description=image.description,
+		url=get_url_by_image(image),
+		api_url=_get_image_api_url(image),
+		category=_get_category_api_url(image.category),
+		width=image.width,
+		height=image.height,
+		views=image.views,
+		created_at=image.created_at,
+		updated_at=image.updated_at,
+	)
+	if _is_selected('thumbnails', fields):
+		values['thumbnails'] = [_get_thumbnail_dict(image, thumbnail_format)
+			for thumbnail_format in get_thumbnail_formats(image)]
+	if neighbours:
+		values['navigation'] = {name: _get_image_api_url(neighbour) if neighbour else None
+			for name, neighbour in vars(neighbours).items()}
+	return _select(values, fields)
+
+
+def _error(message: str, status: int = 400, **kwargs) -> JsonResponse:
+	return JsonResponse(dict(error=message, **kwargs), status=status)
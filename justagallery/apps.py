@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class JustagalleryConfig(AppConfig):
+	name = 'justagallery'
+
+	def ready(self):
+		from .domain import image
+		image.image = import_string(settings.IMAGE_BACKEND)
+		from . import tasks  # registers the handlers of background jobs
+		from . import pagecache  # registers the receivers invalidating cached pages
+		from . import search  # registers the receivers updating the search index
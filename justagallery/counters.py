@@ -0,0 +1,86 @@
+"""
+	View counters, buffered in this process and written to the database periodically, as one
+	update per model and increment instead of one per view. Updates only touch the views column,
+	leaving updated_at alone.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Type
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Model
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending: Dict[Type[Model], Counter] = {}  # increments by pk, by model
+_pending_total = 0
+_flusher: Optional[threading.Thread] = None
+
+
+def count_view(model: Type[Model], pk: int) -> None:
+	"""
+		Add a view to the counter of the object. The view is written to the database within
+		VIEWS_FLUSH_INTERVAL seconds, or at once if VIEWS_FLUSH_INTERVAL is 0.
+	"""
+	global _pending_total, _flusher
+	if not settings.VIEWS_FLUSH_INTERVAL:
+		model.objects.filter(pk=pk).update(views=F('views') + 1)
+		return
+	with _lock:
+		_pending.setdefault(model, Counter())[pk] += 1
+		_pending_total += 1
+		flush_now = _pending_total >= settings.VIEWS_MAX_PENDING
+		if _flusher is None:
+			_flusher = threading.Thread(target=_run_flusher, name='view-counter-flusher', daemon=True)
+			_flusher.start()
+	if flush_now:
+		flush()
+
+
+def flush() -> None:
+	""" Write all buffered views to the database. Views are buffered again if that fails. """
+	global _pending, _pending_total
+	with _lock:
+		pending, _pending, _pending_total = _pending, {}, 0
+	if not pending:
+		return
+	try:
+		with transaction.atomic():
+			for model, counts in pending.items():
+				pks_by_increment: Dict[int, List[int]] = {}
+				for pk, increment in counts.items():
+					pks_by_increment.setdefault(increment, []).append(pk)
+				for increment, pks in pks_by_increment.items():
+					model.objects.filter(pk__in=pks).update(views=F('views') + increment)
+	except Exception:
+		logger.exception('Cannot write view counters, retrying later')
+		with _lock:
+			for model, counts in pending.items():
+				_pending.setdefault(model, Counter()).update(counts)
+				_pending_total += sum(counts.values())
+
+
+def _run_flusher() -> None:
+	while True:
+		time.sleep(settings.VIEWS_FLUSH_INTERVAL)
+		flush()
+		# connections are per thread, don't keep one open while sleeping
+		connections.close_all()
+
+
+def _reset_after_fork() -> None:
+	""" Views buffered in the parent are written by the parent, and the flusher thread is not forked. """
+	global _lock, _pending, _pending_total, _flusher
+	_lock = threading.Lock()
+	_pending, _pending_total, _flusher = {}, 0, None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+# buffered views are written on a graceful shutdown of the process
+atexit.register(flush)
@@ -1,22 +1,67 @@
+import math
 import os
+from typing import Any, Sequence, Dict, FrozenSet, List, Tuple
+
 import PIL.Image
 
 from . import image
 
+Box = Tuple[int, int, int, int]  # left, upper, right, lower
+
 
 class Image(image.Image):
 	""" Implementation using PIL (Pillow) """
 
+	# Minimal factor between the size of the decoded image and the thumbnail, when reducing
+	# the image while decoding it. The same as the default of PIL's thumbnail().
+	REDUCING_GAP = 2.0
+
+	# format and options to save thumbnails with, by encoding
+	SAVE_OPTIONS = {
+		'jpeg': ('JPEG', dict(quality=image.QUALITIES['jpeg'])),
+		'webp': ('WEBP', dict(quality=image.QUALITIES['webp'], method=4)),
+		'avif': ('AVIF', dict(quality=image.QUALITIES['avif'])),  # needs Pillow >= 11.2 or pillow-avif-plugin
+	}
+
+	@staticmethod
+	def create_thumbnail(orig: str, dest: str, size: image.Size, crop: bool, encoding: str = 'jpeg',
+			options: image.EncoderOptions = image.EncoderOptions()) -> None:
+		Image.create_thumbnails(orig, [image.Thumbnail(dest, size, crop, encoding, options)])
+
 	@staticmethod
-	def create_thumbnail(orig: str, dest: str, size: image.Size, crop: bool) -> None:
-		destdir = os.path.dirname(dest)
-		if not os.path.exists(destdir):
-			os.makedirs(destdir)
+	def create_thumbnails(orig: str, thumbnails: Sequence[image.Thumbnail]) -> None:
+		"""
+			Decodes the original once, reduced as far as the largest thumbnail allows, and
+			creates the thumbnails from the largest to the smallest. Every thumbnail is
+			resized from the smallest image created before that is still at least
+			REDUCING_GAP times as large, to keep the quality of resizing from the original.
+			Thumbnails of the same size in multiple encodings are resized once.
+		"""
+		for thumbnail in thumbnails:
+			os.makedirs(os.path.dirname(thumbnail.dest), exist_ok=True)
 		with PIL.Image.open(orig) as im:
-			if crop:
-				im = Image._crop_max_square(im)
-			im.thumbnail(size)
-			im.save(dest, 'JPEG', quality=86)
+			# reduce while decoding, keeping the max (square) part at least REDUCING_GAP times the thumbnail
+			scale = max(Image._get_scale(Image._get_box(im, thumbnail.crop), thumbnail.size) for thumbnail in thumbnails)
+			if scale * Image.REDUCING_GAP < 1:
+				im.draft(None, (math.ceil(im.width * scale * Image.REDUCING_GAP),
+					math.ceil(im.height * scale * Image.REDUCING_GAP)))
+			im.load()
+			# images to resize from, with the box of the part to use, by crop and from large to small
+			sources: Dict[bool, List[Tuple[PIL.Image.Image, Box]]] = {
+				crop: [(im, Image._get_box(im, crop))] for crop in (False, True)}
+			resized: Dict[Tuple[image.Size, bool], PIL.Image.Image] = {}
+			for thumbnail in sorted(thumbnails, key=lambda thumbnail: max(thumbnail.size), reverse=True):
+				thumb = resized.get((thumbnail.size, thumbnail.crop))
+				if thumb is None:
+					source, box = next(((source, box) for source, box in reversed(sources[thumbnail.crop])
+							if Image._get_scale(box, thumbnail.size) * Image.REDUCING_GAP <= 1),
+						sources[thumbnail.crop][0])
+					thumb = source.resize(Image._get_thumbnail_size(box, thumbnail.size), PIL.Image.BICUBIC, box=box,
+						reducing_gap=Image.REDUCING_GAP)
+					resized[thumbnail.size, thumbnail.crop] = thumb
+					sources[thumbnail.crop].append((thumb, Image._get_box(thumb, False)))
+				save_format, options = Image._get_save_options(thumbnail.encoding, thumbnail.options, im.info)
+				thumb.save(thumbnail.dest, save_format, **options)
 
 	@staticmethod
 	def get_size(path: str) -> image.Size:
@@ -24,18 +69,57 @@ class Image(image.Image):
 			return image.Size(*im.size)
 
 	@staticmethod
-	def _crop_center(im, crop_size: image.Size):
-		img_size = image.Size(*im.size)
-		return im.crop((
+	def get_encodings() -> FrozenSet[str]:
+		PIL.Image.init()
+		return frozenset(encoding for encoding in image.ENCODINGS if Image.SAVE_OPTIONS[encoding][0] in PIL.Image.SAVE)
+
+	@staticmethod
+	def _get_save_options(encoding: str, options: image.EncoderOptions, info: Dict[str, Any]) \
+			-> Tuple[str, Dict[str, Any]]:
+		""" Format and options to save a thumbnail with, `info' being of the original """
+		save_format, save_options = Image.SAVE_OPTIONS[encoding]
+		save_options = dict(save_options)
+		if options.quality:
+			save_options['quality'] = options.quality
+		if encoding == 'jpeg':
+			save_options.update(progressive=options.progressive, optimize=options.optimize)
+		if options.subsampling and encoding in ('jpeg', 'avif'):
+			save_options['subsampling'] = options.subsampling
+		if not options.strip_metadata:
+			save_options.update((key, info[key]) for key in ('exif', 'icc_profile') if info.get(key))
+		return save_format, save_options
+
+	@staticmethod
+	def _get_box(im, crop: bool) -> Box:
+		""" Box of the image used for the thumbnail: the max square in the center if cropped. """
+		if crop:
+			return Image._get_center_box(image.Size(*im.size), image.Size(*(min(im.size),)*2))
+		return (0, 0, *im.size)
+
+	@staticmethod
+	def _get_scale(box: Box, size: image.Size) -> float:
+		""" Scale from the box of an image to its thumbnail of given size """
+		thumbnail_size = Image._get_thumbnail_size(box, size)
+		return thumbnail_size[0] / (box[2] - box[0])
+
+	@staticmethod
+	def _get_thumbnail_size(box: Box, size: image.Size) -> image.Size:
+		""" Size of the thumbnail of the box of an image, see image.get_thumbnail_size. """
+		return image.get_thumbnail_size(image.Size(box[2] - box[0], box[3] - box[1]), size, False)
+
+	@staticmethod
+	def _get_center_box(img_size: image.Size, crop_size: image.Size) -> Box:
+		return (
 			(img_size.x - crop_size.x) // 2,
 			(img_size.y - crop_size.y) // 2,
 			(img_size.x + crop_size.x) // 2,
 			(img_size.y + crop_size.y) // 2
-		))
+		)
+
+	@staticmethod
+	def _crop_center(im, crop_size: image.Size):
+		return im.crop(Image._get_center_box(image.Size(*im.size), crop_size))
 
 	@staticmethod
 	def _crop_max_square(im):
 		return Image._crop_center(im, image.Size(*(min(im.size),)*2))
-
-
-
@@ -0,0 +1,65 @@
+import os
+from typing import Any, Dict, FrozenSet, Tuple
+
+import pyvips
+
+from . import image
+
+# Operations are cached by file name by default, while files at the same path can change.
+pyvips.cache_set_max(0)
+
+
+class Image(image.Image):
+	"""
+		Implementation using libvips (pyvips). Images are processed streaming, and JPEGs
+		are shrunk while loading. Multiple thumbnails are created by separate thumbnail
+		operations, which is cheaper than decoding once with shrink-on-load.
+	"""
+
+	# save operation and options of thumbnails, by encoding
+	SAVE_OPTIONS = {
+		'jpeg': ('jpegsave', dict(Q=image.QUALITIES['jpeg'], strip=True)),
+		'webp': ('webpsave', dict(Q=image.QUALITIES['webp'], strip=True)),
+		'avif': ('heifsave', dict(Q=image.QUALITIES['avif'], compression='av1', strip=True)),
+	}
+
+	# libvips can only turn chroma subsampling on (4:2:0) or off (4:4:4), 4:2:2 leaves it to the encoder
+	SUBSAMPLE_MODES = {'4:4:4': 'off', '4:2:0': 'on'}
+
+	@staticmethod
+	def create_thumbnail(orig: str, dest: str, size: image.Size, crop: bool, encoding: str = 'jpeg',
+			options: image.EncoderOptions = image.EncoderOptions()) -> None:
+		os.makedirs(os.path.dirname(dest), exist_ok=True)
+		# EXIF orientation is not applied, like in the PIL implementation
+		if crop:
+			# thumbnail of the max square in the center, not enlarged
+			header = pyvips.Image.new_from_file(orig)
+			side = min(*size, header.width, header.height)
+			im = pyvips.Image.thumbnail(orig, side, height=side, crop='centre', size='down', no_rotate=True)
+		else:
+			im = pyvips.Image.thumbnail(orig, size.x, height=size.y, size='down', no_rotate=True)
+		operation, save_options = Image._get_save_options(encoding, options)
+		getattr(im, operation)(dest, **save_options)
+
+	@staticmethod
+	def get_size(path: str) -> image.Size:
+		# only reads the header
+		im = pyvips.Image.new_from_file(path)
+		return image.Size(im.width, im.height)
+
+	@staticmethod
+	def get_encodings() -> FrozenSet[str]:
+		suffixes = pyvips.base.get_suffixes()
+		return frozenset(encoding for encoding in image.ENCODINGS if '.' + encoding in suffixes)
+
+	@staticmethod
+	def _get_save_options(encoding: str, options: image.EncoderOptions) -> Tuple[str, Dict[str, Any]]:
+		operation, save_options = Image.SAVE_OPTIONS[encoding]
+		save_options = dict(save_options, strip=options.strip_metadata)
+		if options.quality:
+			save_options['Q'] = options.quality
+		if encoding == 'jpeg':
+			save_options.update(interlace=options.progressive, optimize_coding=options.optimize)
+		if options.subsampling in Image.SUBSAMPLE_MODES and encoding in ('jpeg', 'avif'):
+			save_options['subsample_mode'] = Image.SUBSAMPLE_MODES[options.subsampling]
+		return operation, save_options
@@ -0,0 +1,90 @@
+"""
+	Bloom filters, to remember a bounded number of recently seen keys in a fixed amount of memory.
+"""
+import base64
+import hashlib
+import zlib
+from typing import Dict, Iterator, Optional
+
+
+class BloomFilter:
+	"""
+		Set of keys in a fixed number of bits, without false negatives, but with a chance of false positives
+		growing with the number of keys added. Every key sets `hashes' bits, derived from one blake2b hash
+		by double hashing.
+	"""
+
+	def __init__(self, bits: int = 8192, hashes: int = 7, data: Optional[bytes] = None):
+		self.bits = bits
+		self.hashes = hashes
+		self.data = bytearray(data if data is not None else bits // 8)
+		if len(self.data) * 8 != bits:
+			raise ValueError('Expected {} bytes of data'.format(bits // 8))
+
+	def _positions(self, key: str) -> Iterator[int]:
+		digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		for i in range(self.hashes):
+			yield (h1 + i * h2) % self.bits
+
+	def add(self, key: str) -> None:
+		for position in self._positions(key):
+			self.data[position >> 3] |= 1 << (position & 7)
+
+	def __contains__(self, key: str) -> bool:
+		return all(self.data[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RotatingBloomFilter:
+	"""
+		Remembers at least the last `capacity' keys added, with two Bloom filters: when the current
+		one is full, it replaces the previous one and a new current one is started. However many keys are
+		added, this bounds the size (under 3KB serialized with the defaults) and the false positive rate
+		(at most about 1.5% with the defaults).
+	"""
+
+	def __init__(self, capacity: int = 800, bits: int = 8192, hashes: int = 7):
+		self.capacity = capacity
+		self.count = 0
+		self.current = BloomFilter(bits, hashes)
+		self.previous = BloomFilter(bits, hashes)
+
+	def add(self, key: str) -> None:
+		if self.count >= self.capacity:
+			self.previous = self.current
+			self.current = BloomFilter(self.current.bits, self.current.hashes)
+			self.count = 0
+		self.current.add(key)
+		self.count += 1
+
+	def __contains__(self, key: str) -> bool:
+		return key in self.current or key in self.previous
+
+	def to_dict(self) -> Dict:
+		""" Serialize to a JSON serializable dict, compressed as mostly empty filters compress well. """
+		return {
+			'count': self.count,
+			'current': _encode(self.current.data),
+			'previous': _encode(self.previous.data),
+		}
+
+	@classmethod
+	def from_dict(cls, dct: Dict, capacity: int = 800, bits: int = 8192, hashes: int = 7) -> 'RotatingBloomFilter':
+		""" :raises ValueError if the serialized filters don't match the given size """
+		bloom_filter = cls(capacity, bits, hashes)
+		try:
+			bloom_filter.count = dct['count']
+			bloom_filter.current = BloomFilter(bits, hashes, _decode(dct['current']))
+			bloom_filter.previous = BloomFilter(bits, hashes, _decode(dct['previous']))
+		except (KeyError, TypeError, zlib.error) as e:
+			raise ValueError('Invalid serialized filter: {}'.format(e))
+		return bloom_filter
+
+
+def _encode(data: bytes) -> str:
+	return base64.b64encode(zlib.compress(data)).decode('ascii')
+
+
+def _decode(data: str) -> bytes:
+	return zlib.decompress(base64.b64decode(data))
@@ -1,33 +1,62 @@
-from typing import Iterator, Optional, Any
+from typing import Optional, Any, Iterable, List
 
 from . import entities
 
 
-def get_display_formats(model: Any) -> Iterator[entities.ThumbnailFormat]:
-	""" Retrieve display formats recursivly to the root category. """
+def get_display_formats(model: Any) -> Iterable[entities.ThumbnailFormat]:
+	"""
+		Retrieve display formats of image or category. If not defined, these are
+		inherited from the (parent) category, as stored in the effective settings.
+	"""
 	if isinstance(model, entities.Image):
-		display_formats = model.display_formats.all()
-		if len(display_formats) > 0:
-			return display_formats
+		if model.has_display_formats:
+			return model.display_formats.all()
 		model = model.category
 	if isinstance(model, entities.Category):
-		while model:
-			display_formats = model.display_formats.all()
-			if len(display_formats) > 0:
-				return display_formats
-			model = model.parent
+		return model.effective_display_formats.all()
 
 def get_default_thumbnail_format(category: entities.Category) -> Optional[entities.ThumbnailFormat]:
-	""" Retrieve default thumbnail format recursively to the root category. """
-	return next(get_default_thumbnail_formats(category), None)
+	""" Retrieve default thumbnail format of category, inherited from the nearest parent category having one. """
+	return category.effective_thumbnail_format
+
+def get_default_thumbnail_formats(category: entities.Category) -> Iterable[entities.ThumbnailFormat]:
+	""" Retrieve all default thumbnail formats of the category and its parents. """
+	return category.effective_thumbnail_formats.all()
 
-def get_default_thumbnail_formats(category: entities.Category) -> Iterator[entities.ThumbnailFormat]:
-	""" Retrieve all default thumbnail formats recursively to the root category. """
-	while category:
-		default_thumbnail_format = category.default_thumbnail_format
-		if default_thumbnail_format:
-			yield default_thumbnail_format
-		category = category.parent
+def get_image_display_formats(image: entities.Image) -> List[entities.ThumbnailFormat]:
+	"""
+		Retrieve the display formats of the image that are smaller than the original image,
+		sorted by size. If there are none, a format matching the original image size is returned.
+	"""
+	display_formats = sorted((df for df in get_display_formats(image)
+			# filter out thumbnailformats that are larger than or equal to original image.
+			if not (image.width and image.height) or df.width < image.width or df.height < image.height),
+		key=lambda df: (df.width, df.height, df.crop))
+
+	if len(display_formats) == 0 and image.width and image.height:
+		# No suitable thumbnail formats found. Create one that matches
+		# the original image size.
+		size: int = max(image.width, image.height)
+		df_dct = {
+			'width': size,
+			'height': size,
+			'crop': False,
+		}
+		display_formats.append(type('ThumbnailFormat', (entities.ThumbnailFormat,), df_dct)())
+	return display_formats
+
+def get_thumbnail_formats(image: entities.Image) -> List[entities.ThumbnailFormat]:
+	"""
+		Retrieve all formats thumbnails of the image are shown in: the display formats
+		of the image, and the default thumbnail formats of its category and parents.
+	"""
+	formats = get_image_display_formats(image)
+	sizes = {(df.width, df.height, df.crop) for df in formats}
+	for df in get_default_thumbnail_formats(image.category):
+		if (df.width, df.height, df.crop) not in sizes:
+			sizes.add((df.width, df.height, df.crop))
+			formats.append(df)
+	return formats
 
 def get_default_image(category: entities.Category) -> entities.Image:
 	"""
@@ -60,10 +89,7 @@ def get_default_image(category: entities.Category) -> entities.Image:
 
 def is_private(category: entities.Category) -> Optional[entities.User]:
 	"""
-		Looks up if category or its parents are private.
+		Looks up if category or its parents are private, as stored in the effective settings.
 		:return: owner if private, None if not private
 	"""
-	while category:
-		if category.private:
-			return category.owner
-		category = category.parent
+	return category.private_owner
@@ -40,12 +40,19 @@ class ThumbnailFormat:
 	width: int
 	height: int
 	crop: bool
+	# encoder options, see domain.image.EncoderOptions
+	quality: Optional[int] = None
+	progressive: bool = False
+	optimize: bool = False
+	subsampling: str = ''
+	strip_metadata: bool = True
 
 class Category:
 	id: int
 	parent: 'Category'
 	title: str
 	slug: str
+	path: str
 	description: str
 	created_at: datetime
 	updated_at: datetime
@@ -58,6 +65,18 @@ class Category:
 	owner: User
 	hidden: bool
 	private: bool
+	page_size: Optional[int]
+	# Statistics, including the categories below
+	image_count: int
+	total_image_count: int
+	total_bytes: int
+	cover_image: Optional['Image']
+	# Effective settings, inherited from the parents
+	private_owner: Optional[User]
+	effective_hidden: bool
+	effective_thumbnail_format: Optional[ThumbnailFormat]
+	effective_thumbnail_formats: EntityManager[ThumbnailFormat]
+	effective_display_formats: EntityManager[ThumbnailFormat]
 
 class Image:
 	id: int
@@ -68,4 +87,8 @@ class Image:
 	created_at: datetime
 	updated_at: datetime
 	display_formats: EntityManager[ThumbnailFormat]
+	has_display_formats: bool
 	owner: User
+	width: int
+	height: int
+	filesize: int
@@ -1,15 +1,50 @@
 from __future__ import annotations
+import math
+import os
+import tempfile
 from abc import ABCMeta
-from typing import NamedTuple, Type
+from contextlib import contextmanager, ExitStack
+from typing import FrozenSet, NamedTuple, Optional, Type, Iterator, Sequence
+
+try:
+	import fcntl
+except ImportError:  # not available on all platforms, thumbnails are created without locking then
+	fcntl = None
 
 
 class Size(NamedTuple):
 	x: int
 	y: int
 
+# Encodings of thumbnails, besides JPEG
+ENCODINGS = ('webp', 'avif')
+
+# Quality of thumbnails by encoding, unless set by their EncoderOptions. The same for every implementation.
+QUALITIES = {'jpeg': 86, 'webp': 80, 'avif': 50}
+
+# Chroma subsampling modes
+SUBSAMPLINGS = ('4:4:4', '4:2:2', '4:2:0')
+
+class EncoderOptions(NamedTuple):
+	""" How a thumbnail is encoded. Options not applicable to an encoding are ignored for it. """
+	quality: Optional[int] = None  # 1-100, None for the default of the encoding
+	progressive: bool = False  # JPEG only
+	optimize: bool = False  # optimized Huffman coding, JPEG only
+	subsampling: Optional[str] = None  # one of SUBSAMPLINGS, None for the default of the encoding
+	strip_metadata: bool = True  # otherwise EXIF and the ICC profile of the original are kept
+
+class Thumbnail(NamedTuple):
+	""" Thumbnail to create, see Image.create_thumbnail for the meaning of the fields """
+	dest: str
+	size: Size
+	crop: bool
+	encoding: str = 'jpeg'
+	options: EncoderOptions = EncoderOptions()
+
 class Image(metaclass=ABCMeta):
 	@staticmethod
-	def create_thumbnail(orig: str, dest: str, size: Size, crop: bool) -> None:
+	def create_thumbnail(orig: str, dest: str, size: Size, crop: bool, encoding: str = 'jpeg',
+			options: EncoderOptions = EncoderOptions()) -> None:
 		"""
 			Create thumbnail from original image `orig', writing to
 			`dest'. The given size is indicating the maximum of either
@@ -21,14 +56,31 @@ class Image(metaclass=ABCMeta):
 			:param dest: path to destination file
 			:param size: x and y size of the thumbnail
 			:param crop: whether the thumbnail must be cropped
+			:param encoding: 'jpeg' or one of ENCODINGS, as returned by get_encodings()
+			:param options: quality and other options of the encoder
 		"""
 		...
 
+	@classmethod
+	def create_thumbnails(cls, orig: str, thumbnails: Sequence[Thumbnail]) -> None:
+		"""
+			Create multiple thumbnails from original image `orig'. Implementations
+			should decode the original only once. By default create_thumbnail()
+			is called for every thumbnail.
+		"""
+		for thumbnail in thumbnails:
+			cls.create_thumbnail(orig, *thumbnail)
+
 	@staticmethod
 	def get_size(path: str) -> Size:
 		""" Retrieve the size of the given image on disk. """
 		...
 
+	@staticmethod
+	def get_encodings() -> FrozenSet[str]:
+		""" Encodings of ENCODINGS the implementation can write, as available in the libraries installed. """
+		return frozenset()
+
 image: Type[Image] = None # Image implementation used in this module. Defaults to _pil.Image if not set
 
 def _image() -> Type[Image]:
@@ -41,9 +93,100 @@ def _image() -> Type[Image]:
 
 
 def create_thumbnail(orig: str, dest: str, size: Size, crop: bool):
-	return _image().create_thumbnail(orig, dest, size, crop)
-create_thumbnail.__doc__ = Image.create_thumbnail.__doc__
+	""" Create thumbnail using the Image implementation, see create_thumbnails() and Image.create_thumbnail. """
+	create_thumbnails(orig, [Thumbnail(dest, size, crop)])
+
+def create_thumbnails(orig: str, thumbnails: Sequence[Thumbnail], replace: bool = False):
+	"""
+		Create thumbnails from one original using the Image implementation, see Image.create_thumbnail.
+
+		Concurrent creation of the same thumbnail, by threads or processes, is done only
+		once: the others wait for it and do nothing if the thumbnail exists by then.
+		Thumbnails are written to temporary files first and renamed when complete.
+
+		:param replace: create the thumbnails that exist as well, replacing them
+	"""
+	thumbnails = sorted((thumbnail._replace(dest=str(thumbnail.dest)) for thumbnail in thumbnails),
+		key=lambda thumbnail: thumbnail.dest)  # lock in a fixed order, to prevent deadlocks
+	with ExitStack() as stack:
+		tmp_thumbnails = []
+		for thumbnail in thumbnails:
+			os.makedirs(os.path.dirname(thumbnail.dest), exist_ok=True)
+			stack.enter_context(_lock(thumbnail.dest))
+			if replace or not os.path.exists(thumbnail.dest):  # or created meanwhile
+				tmp_thumbnails.append(thumbnail._replace(dest=stack.enter_context(_temporary_file(thumbnail.dest))))
+		if tmp_thumbnails:
+			_image().create_thumbnails(orig, tmp_thumbnails)
 
 def get_size(path: str) -> Size:
 	return _image().get_size(path)
 get_size.__doc__ = Image.get_size.__doc__
+
+def get_encodings() -> FrozenSet[str]:
+	return _image().get_encodings()
+get_encodings.__doc__ = Image.get_encodings.__doc__
+
+def get_thumbnail_size(size: Size, thumbnail_size: Size, crop: bool) -> Size:
+	"""
+		Size of the thumbnail of an image of `size', fitting in `thumbnail_size' (of its format) and not
+		enlarged, rounded like PIL's thumbnail() does. Other implementations may differ a pixel.
+		:param crop: if the thumbnail is of the max square in the center of the image
+	"""
+	width, height = (min(size),) * 2 if crop else size
+	x, y = thumbnail_size
+	if x >= width and y >= height:
+		return Size(width, height)
+
+	def round_aspect(number, key):
+		return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+	aspect = width / height
+	if x / y >= aspect:
+		x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+	else:
+		y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+	return Size(x, y)
+
+
+@contextmanager
+def _lock(path: str) -> Iterator[None]:
+	"""
+		Exclusive lock for `path', using a hidden lock file next to it. Works between
+		threads as well as processes. The lock file is removed on release.
+	"""
+	if not fcntl:
+		yield
+		return
+	lock_path = os.path.join(os.path.dirname(path), '.{}.lock'.format(os.path.basename(path)))
+	while True:
+		fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+		fcntl.flock(fd, fcntl.LOCK_EX)
+		try:
+			if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+				break
+		except FileNotFoundError:
+			pass
+		# lock file got removed by the previous holder while waiting for it, try again.
+		os.close(fd)
+	try:
+		yield
+	finally:
+		os.unlink(lock_path)
+		os.close(fd)
+
+@contextmanager
+def _temporary_file(path: str) -> Iterator[str]:
+	"""
+		Hidden temporary file next to `path', to write to. It is renamed to `path'
+		on success, and removed on failure.
+	"""
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.{}.'.format(os.path.basename(path)),
+		suffix='.tmp')
+	os.close(fd)
+	try:
+		yield tmp
+		os.chmod(tmp, 0o644)
+		os.replace(tmp, path)
+	except BaseException:
+		os.unlink(tmp)
+		raise
@@ -2,46 +2,62 @@ from typing import Dict, Optional, Tuple, TypeVar, Generic, Union
 
 from . import entities
 
-_URLS_TO_CATEGORY: Dict[str, entities.Category] = {}
-
 ExtendsCategory = TypeVar('ExtendsCategory', bound=entities.Category)
 
 
 def get_category_by_url(url: str, repository: entities.Repository[ExtendsCategory]) -> Optional[ExtendsCategory]:
-	url_parts = url.split('/')
-	category = None
-	for url_part in url_parts:
-		category = repository.filter(parent=category, slug=url_part).first()
-		if not category:
-			return None
-	return category
+	"""
+		Look up category by its url (without leading and trailing slashes), in one query by its stored path.
+		Not cached, so its settings and privacy are never outdated, not even when changed by another process.
+	"""
+	return repository.filter(path=url).first()
+
+
+def get_path_by_category(category: entities.Category) -> str:
+	""" Calculate path of category from its slug and the path of its parent, to be stored. """
+	if category.parent:
+		return "{}/{}".format(category.parent.path, category.slug)
+	return category.slug
 
 
 def get_url_by_category(category: entities.Category) -> str:
-	url_parts = []
-	while(category):
-		url_parts.append(category.slug)
-		category = category.parent
-	url_parts.reverse()
-	return '/' + '/'.join(url_parts) + '/'
+	return '/' + category.path + '/'
 
 
 def get_url_by_image(image: entities.Image, format: entities.ThumbnailFormat = None) -> str:
 	category_part = get_url_by_category(image.category)
 	url = "{}{}.html".format(category_part, image.slug)
 	if format:
-		url += '?format={}'.format(_get_size(format))
+		url += '?format={}'.format(get_size_str(format))
 	return url
 
 
 def get_thumbnail_url(image: entities.Image, thumbnail_format: entities.ThumbnailFormat) -> str:
-	return "/thumbnails/{}/{}/{}".format(
+	"""
+		URL of the thumbnail, versioned by the modification time of the image, so the
+		thumbnail can be cached forever by clients.
+	"""
+	url = "/thumbnails/" + get_thumbnail_path(image, thumbnail_format)
+	if image.updated_at:
+		url += '?v=' + get_thumbnail_version(image)
+	return url
+
+
+def get_thumbnail_version(image: entities.Image) -> str:
+	""" Version of the thumbnails of the image in their urls, changing with every change of the image. """
+	return '{:x}'.format(int(image.updated_at.timestamp()))
+
+
+def get_thumbnail_path(image: entities.Image, thumbnail_format: entities.ThumbnailFormat) -> str:
+	""" Path of the thumbnail, relative to the thumbnails directory. """
+	return "{}/{}/{}".format(
 		image.category.id,
-		_get_size(thumbnail_format),
+		get_size_str(thumbnail_format),
 		image.slug
 	)
 
-def _get_size(format: entities.ThumbnailFormat) -> str:
+def get_size_str(format: entities.ThumbnailFormat) -> str:
+	""" Size of the format as in urls, like 200x200-c, see get_size_from_str. """
 	return "{}x{}{}".format(
 		format.width,
 		format.height,
@@ -0,0 +1,135 @@
+"""
+	Queue of background jobs, stored in the database, executed by the run_jobs command.
+	Handlers of jobs are registered with the `handler' decorator, see tasks.py.
+"""
+from __future__ import annotations
+
+import logging
+import signal
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+_HANDLERS: Dict[str, Callable[..., None]] = {}
+
+
+class JobTimeout(Exception):
+	pass
+
+
+def handler(func: Callable[..., None]) -> Callable[..., None]:
+	""" Register function as handler of the jobs having its name, called with the arguments of the job. """
+	_HANDLERS[func.__name__] = func
+	return func
+
+
+def enqueue(name: str, **kwargs: Any) -> Optional[models.Job]:
+	"""
+		Add a job for the handler with the given name, to be called with the keyword arguments,
+		which must be JSON serializable. If JOBS_ENABLED is off, the job is executed at once.
+		A job created in a transaction is only picked up, or executed, once the transaction is committed.
+	"""
+	if not settings.JOBS_ENABLED:
+		transaction.on_commit(lambda: _run_now(name, kwargs))
+		return None
+	return models.Job.objects.create(name=name, kwargs=kwargs, max_attempts=settings.JOBS_MAX_ATTEMPTS)
+
+
+def enqueue_many(name: str, kwargs_list: Iterable[Dict[str, Any]]) -> None:
+	""" Add jobs like `enqueue', with one query. """
+	if not settings.JOBS_ENABLED:
+		for kwargs in kwargs_list:
+			transaction.on_commit(lambda kwargs=kwargs: _run_now(name, kwargs))
+		return
+	models.Job.objects.bulk_create([models.Job(name=name, kwargs=kwargs, max_attempts=settings.JOBS_MAX_ATTEMPTS)
+		for kwargs in kwargs_list], batch_size=500)
+
+
+def claim(worker: str) -> Optional[models.Job]:
+	"""
+		Take the oldest job that is due, marking it running by the worker. Safe to be called by
+		workers concurrently, a job is claimed by one of them only.
+	"""
+	now = datetime.now()
+	candidates: List[models.Job] = list(models.Job.objects.filter(state=models.Job.QUEUED, run_after__lte=now)
+		.order_by('run_after', 'id')[:10])
+	for job in candidates:
+		if models.Job.objects.filter(pk=job.pk, state=models.Job.QUEUED).update(
+				state=models.Job.RUNNING, worker=worker, started_at=now, attempts=F('attempts') + 1):
+			job.refresh_from_db()
+			return job
+	return None
+
+
+def run(job: models.Job) -> None:
+	"""
+		Execute the claimed job, within JOBS_TIMEOUT seconds. A failed job is retried after a delay
+		doubling on every attempt, until it reached its maximum attempts, after which it's dead.
+		Must be called from the main thread, as the timeout uses SIGALRM.
+	"""
+	start = time.monotonic()
+	previous_handler = signal.signal(signal.SIGALRM, _timeout)
+	signal.alarm(settings.JOBS_TIMEOUT)
+	try:
+		_HANDLERS[job.name](**job.kwargs)
+		job.state = models.Job.DONE
+		job.error = ''
+	except Exception:
+		job.error = traceback.format_exc()
+		if job.attempts >= job.max_attempts:
+			job.state = models.Job.DEAD
+			logger.error('Job {} {}({}) is dead after {} attempts:\n{}'.format(
+				job.pk, job.name, job.kwargs, job.attempts, job.error))
+		else:
+			job.state = models.Job.QUEUED
+			job.run_after = datetime.now() + timedelta(seconds=settings.JOBS_RETRY_DELAY * 2 ** (job.attempts - 1))
+			logger.warning('Job {} {}({}) failed, retrying at {}:\n{}'.format(
+				job.pk, job.name, job.kwargs, job.run_after, job.error))
+	finally:
+		signal.alarm(0)
+		signal.signal(signal.SIGALRM, previous_handler)
+	job.duration = time.monotonic() - start
+	job.finished_at = datetime.now()
+	job.save(update_fields=['state', 'error', 'run_after', 'duration', 'finished_at'])
+	logger.debug('Job {} {}({}) {} in {:.3f}s'.format(job.pk, job.name, job.kwargs, job.state, job.duration))
+
+
+def clean_up() -> None:
+	"""
+		Requeue jobs that are running for longer than the timeout, their worker got killed, unless
+		they reached their maximum attempts: then they're dead, so a job killing its worker (by
+		running out of memory, for instance) doesn't do so forever. Remove finished jobs older
+		than JOBS_KEEP_DONE seconds.
+	"""
+	now = datetime.now()
+	stale = models.Job.objects.filter(state=models.Job.RUNNING,
+		started_at__lt=now - timedelta(seconds=settings.JOBS_TIMEOUT + 60))
+	for job in stale.filter(attempts__gte=F('max_attempts')):
+		error = 'Worker {} got killed running the job'.format(job.worker)
+		if stale.filter(pk=job.pk).update(state=models.Job.DEAD, error=error, finished_at=now):
+			logger.error('Job {} {}({}) is dead after {} attempts: {}'.format(
+				job.pk, job.name, job.kwargs, job.attempts, error))
+	stale.update(state=models.Job.QUEUED)
+	models.Job.objects.filter(state=models.Job.DONE,
+		finished_at__lt=now - timedelta(seconds=settings.JOBS_KEEP_DONE)).delete()
+
+
+def _run_now(name: str, kwargs: Dict[str, Any]) -> None:
+	""" Execute the job at once, only logging failures like a job in the queue would. """
+	try:
+		_HANDLERS[name](**kwargs)
+	except Exception:
+		logger.exception('Job {}({}) failed'.format(name, kwargs))
+
+
+def _timeout(signum, frame):
+	raise JobTimeout('Job took longer than {}s'.format(settings.JOBS_TIMEOUT))
@@ -0,0 +1,127 @@
+"""
+	Loaders fetching all data needed to render a page in a fixed number of queries,
+	regardless of the number of items on the page.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional
+
+from django.db.models import Q, QuerySet
+
+from . import models
+
+
+class Cursor(NamedTuple):
+	""" Position of an image in its category, in order of sequence and id. Identifies pages in urls. """
+	sequence: int
+	id: int
+
+	def __str__(self):
+		return '{}.{}'.format(self.sequence, self.id)
+
+	@classmethod
+	def from_str(cls, value: str) -> 'Cursor':
+		""" :raises ValueError if not a cursor as returned by str() """
+		sequence, id = value.split('.')
+		return cls(int(sequence), int(id))
+
+	@classmethod
+	def of(cls, image: models.Image) -> 'Cursor':
+		return cls(image.sequence, image.id)
+
+
+@dataclass
+class CategoryPage:
+	children: List[models.Category]  # on the first page only
+	covers: Dict[int, models.Image]  # cover image by child category id, if it has any
+	images: List[models.Image]
+	previous: Optional[Cursor] = None  # the previous page has the images before it, if there are any
+	next: Optional[Cursor] = None  # the next page has the images after it, if there are any
+	previous_is_first: bool = False  # the previous page is the first page, to be linked without a cursor
+
+
+def load_category_page(category: models.Category, children: QuerySet, page_size: int,
+		after: Optional[Cursor] = None, before: Optional[Cursor] = None) -> CategoryPage:
+	"""
+		Load a page of images of the category, together with the (visible) children of the
+		category and their cover images if it's the first page.
+		Pages are found by seeking the index on category, sequence and id from the cursor,
+		so the cost of a page doesn't depend on the number of images before it.
+		:param children: query of the children of the category to show
+		:param after: load the images after the cursor, the first page if neither `after' nor `before' is given
+		:param before: load the images before the cursor, the first page if there are no more before them
+	"""
+	has_previous: Optional[bool] = None  # unknown yet
+	has_next: Optional[bool] = None
+	if before is not None:
+		images = list(category.images.filter(_before(before)).order_by('-sequence', '-id')[:page_size + 1])
+		if len(images) <= page_size:
+			# no more images before them: the first page, which has one url only, with the children
+			return load_category_page(category, children, page_size)
+		has_previous = True
+		images = images[:page_size][::-1]
+	else:
+		images = category.images.order_by('sequence', 'id')
+		if after is not None:
+			images = images.filter(_after(after))
+		else:
+			has_previous = False
+		images = list(images[:page_size + 1])
+		has_next = len(images) > page_size
+		images = images[:page_size]
+	first_page = after is None and before is None
+	children = list(children) if first_page else []
+	previous_count = 0  # of the images before the page, up to a page more
+	if images and not first_page:
+		previous_count = category.images.filter(_before(Cursor.of(images[0]))).order_by('-sequence', '-id') \
+			.values('id')[:page_size + 1].count()
+		has_previous = previous_count > 0
+	if images and has_next is None:
+		has_next = category.images.filter(_after(Cursor.of(images[-1]))).exists()
+	covers: Dict[int, models.Image] = {}
+	if cover_ids := {child.id: child.cover_image_id for child in children if child.cover_image_id}:
+		cover_images = models.Image.objects.filter(id__in=set(cover_ids.values())).select_related('category')
+		cover_images_by_id = {image.id: image for image in cover_images}
+		covers = {category_id: cover_images_by_id[image_id] for category_id, image_id in cover_ids.items()
+			if image_id in cover_images_by_id}
+	return CategoryPage(children=children, covers=covers, images=images,
+		previous=Cursor.of(images[0]) if has_previous else None,
+		next=Cursor.of(images[-1]) if has_next else None,
+		previous_is_first=bool(has_previous) and previous_count <= page_size)
+
+
+def _after(cursor: Cursor) -> Q:
+	# the condition on sequence alone lets the database seek the index, instead of scanning it
+	return Q(sequence__gte=cursor.sequence) & (Q(sequence__gt=cursor.sequence) | Q(id__gt=cursor.id))
+
+
+def _before(cursor: Cursor) -> Q:
+	return Q(sequence__lte=cursor.sequence) & (Q(sequence__lt=cursor.sequence) | Q(id__lt=cursor.id))
+
+
+@dataclass
+class ImageNeighbours:
+	""" Images around an image in its category, in order of sequence and id. None where the image is first or last. """
+	first: Optional[models.Image] = None
+	previous: Optional[models.Image] = None
+	next: Optional[models.Image] = None
+	last: Optional[models.Image] = None
+
+
+def load_image_neighbours(image: models.Image) -> ImageNeighbours:
+	"""
+		Load the first, previous, next and last image of the category of the image, by at most
+		four seeks on the index on category, sequence and id, regardless of the number of images.
+	"""
+	images = models.Image.objects.filter(category_id=image.category_id)
+	cursor = Cursor.of(image)
+	neighbours = ImageNeighbours()
+	neighbours.previous = images.filter(_before(cursor)).order_by('-sequence', '-id').first()
+	if neighbours.previous:
+		neighbours.first = images.order_by('sequence', 'id').first()
+	neighbours.next = images.filter(_after(cursor)).order_by('sequence', 'id').first()
+	if neighbours.next:
+		neighbours.last = images.order_by('-sequence', '-id').first()
+	for neighbour in (neighbours.first, neighbours.previous, neighbours.next, neighbours.last):
+		if neighbour:
+			neighbour.category = image.category
+	return neighbours
@@ -0,0 +1,76 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import PIL.Image
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from ...domain import image, _pil
+
+
+def _pil_full_decode(orig: str, dest: str, size: image.Size, crop: bool) -> None:
+	""" Thumbnail creation by PIL without reducing the image while decoding, as reference. """
+	with PIL.Image.open(orig) as im:
+		im.load()
+		if crop:
+			im = _pil.Image._crop_max_square(im)
+		im.thumbnail(size, reducing_gap=None)
+		im.save(dest, 'JPEG', quality=86)
+
+
+# Image implementations or create_thumbnail functions, imported when used, to skip unavailable ones
+_IMPLEMENTATIONS: Dict[str, str] = {
+	'pil': 'justagallery.domain._pil.Image',
+	'pil-full-decode': __name__ + '._pil_full_decode',
+	'vips': 'justagallery.domain._vips.Image',
+}
+
+
+def _run(implementation: str, files: List[str], size: image.Size, crop: bool, repeat: int) -> Tuple[float, int, int]:
+	"""
+		Create thumbnails of all files `repeat' times, in a fresh process.
+		:return: seconds elapsed, max resident set size (KiB) before and after
+	"""
+	create_thumbnail = import_string(_IMPLEMENTATIONS[implementation])
+	create_thumbnail = getattr(create_thumbnail, 'create_thumbnail', create_thumbnail)
+	rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	with tempfile.TemporaryDirectory() as tmpdir:
+		start = time.perf_counter()
+		for _ in range(repeat):
+			for i, orig in enumerate(files):
+				create_thumbnail(orig, os.path.join(tmpdir, '{}.jpg'.format(i)), size, crop)
+		elapsed = time.perf_counter() - start
+	return elapsed, rss_before, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+	help = 'Compare time and peak memory of thumbnail implementations on the given original images.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('files', nargs='+', metavar='file', help='Original image to create thumbnails of.')
+		parser.add_argument('-s', '--size', type=int, default=200, help='Size of the thumbnails, default 200.')
+		parser.add_argument('-c', '--crop', action='store_true', help='Create cropped thumbnails.')
+		parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs over the files, default 3.')
+		parser.add_argument('-i', '--implementation', action='append', choices=_IMPLEMENTATIONS.keys(),
+			help='Implementation to run, can be given multiple times. Defaults to all.')
+
+	def handle(self, *args, files, size, crop, repeat, implementation, **options):
+		self.stdout.write('{:<16} {:>10} {:>12} {:>14}'.format(
+			'implementation', 'seconds', 'per image', 'peak RSS (MiB)'))
+		for name in implementation or _IMPLEMENTATIONS:
+			# Run every implementation in a fresh process, to measure its peak memory usage
+			with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+				try:
+					elapsed, rss_before, rss_after = executor.submit(
+						_run, name, files, image.Size(size, size), crop, repeat).result()
+				except ImportError as e:
+					self.stdout.write('{:<16} not available: {}'.format(name, e))
+					continue
+			self.stdout.write('{:<16} {:>10.3f} {:>11.1f}ms {:>7.1f} (+{:.1f})'.format(
+				name, elapsed, elapsed / (repeat * len(files)) * 1000, rss_after / 1024,
+				(rss_after - rss_before) / 1024))
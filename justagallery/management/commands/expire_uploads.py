@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ...uploads import expire_uploads
+
+
+class Command(BaseCommand):
+	help = 'Remove unfinished uploads of the API that received no chunk for a while, with their staged files. ' \
+		'Done by run_jobs as well, run this periodically when the job queue is not used.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('-a', '--age', type=int, default=settings.UPLOADS_EXPIRE,
+			help='Seconds since the last chunk received. Defaults to the UPLOADS_EXPIRE setting.')
+
+	def handle(self, *args, age, **options):
+		self.stdout.write('Removed {} unfinished uploads'.format(expire_uploads(age)))
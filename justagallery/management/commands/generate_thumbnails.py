@@ -0,0 +1,60 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ...domain.image import create_thumbnails
+from ...thumbnails import get_images, get_missing_thumbnails, get_thumbnails
+
+
+class Command(BaseCommand):
+	help = 'Generate all missing thumbnails of the images in the display formats and default thumbnail formats ' \
+		'they are shown in, in parallel.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('albums', nargs='*', metavar='album',
+			help='Path of album (like in the url) to generate the thumbnails of, including its sub-albums. '
+				'All albums if not given.')
+		parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+			help='Number of processes rendering thumbnails. Defaults to the number of CPUs.')
+		parser.add_argument('-n', '--dry-run', action='store_true',
+			help='Only report the thumbnails that would be generated.')
+
+	def handle(self, *args, albums, jobs, dry_run, **options):
+		thumbnails = {}  # by original
+		for image in get_images(album.strip('/') for album in albums):
+			if missing := get_missing_thumbnails(image):
+				thumbnails[image.file.path] = get_thumbnails(missing)
+				if options['verbosity'] > 1:
+					for thumbnail in thumbnails[image.file.path]:
+						self.stdout.write(thumbnail.dest)
+		total = sum(len(image_thumbnails) for image_thumbnails in thumbnails.values())
+		if dry_run or not total:
+			self.stdout.write('{} thumbnails to generate'.format(total))
+			return
+
+		# Connections can't be shared with the forked processes, and are not needed there.
+		connections.close_all()
+		done = failed = 0
+		start = last_report = time.monotonic()
+		with ProcessPoolExecutor(max_workers=jobs) as executor:
+			# all thumbnails of an image are created at once, decoding the original only once
+			futures = {executor.submit(create_thumbnails, orig, image_thumbnails): (orig, len(image_thumbnails))
+				for orig, image_thumbnails in thumbnails.items()}
+			for future in as_completed(futures):
+				orig, count = futures[future]
+				try:
+					future.result()
+					done += count
+				except Exception as e:
+					failed += count
+					self.stderr.write('Cannot create thumbnails of {}: {}'.format(orig, e))
+				now = time.monotonic()
+				if now - last_report >= 1 or done + failed == total:
+					last_report = now
+					self.stdout.write('[{}/{}] {:.1f} thumbnails/s'.format(
+						done + failed, total, (done + failed) / (now - start)))
+		self.stdout.write('Generated {} thumbnails in {:.1f}s, {} failed'.format(
+			done, time.monotonic() - start, failed))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ... import models, pagecache
+from ...thumbnails import invalidate_category_thumbnails
+
+
+class Command(BaseCommand):
+	help = 'Recalculate the stored (denormalized) data of all categories: their paths, effective settings and ' \
+		'statistics.'
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			changed = models.rebuild_paths()
+			self.stdout.write('Updated paths of {} categories'.format(changed))
+			models.rebuild_effective_settings()
+			self.stdout.write('Updated effective settings')
+			changed = models.rebuild_statistics()
+			self.stdout.write('Updated statistics of {} categories'.format(changed))
+		# the categories are updated without signals
+		invalidate_category_thumbnails()
+		pagecache.invalidate_all()
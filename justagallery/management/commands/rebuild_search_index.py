@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ... import search
+
+
+class Command(BaseCommand):
+	help = 'Index the titles and descriptions of all categories and images again, for the search.'
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			count = search.rebuild_index()
+		self.stdout.write('Indexed {} categories and images'.format(count))
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Tuple
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ...domain.category import get_thumbnail_formats
+from ...domain.image import Thumbnail, create_thumbnails
+from ...thumbnails import get_encodings, get_images, get_thumbnail_file, get_thumbnails
+
+
+def _reencode(orig: str, thumbnails: List[Thumbnail], dry_run: bool) -> int:
+	"""
+		Create the thumbnails again from the original, replacing them, or into a temporary
+		directory when dry running.
+		:return: total size of the new thumbnails
+	"""
+	if not dry_run:
+		create_thumbnails(orig, thumbnails, replace=True)
+		return sum(os.path.getsize(thumbnail.dest) for thumbnail in thumbnails)
+	with tempfile.TemporaryDirectory() as directory:
+		thumbnails = [thumbnail._replace(dest=os.path.join(directory, str(i))) for i, thumbnail in enumerate(thumbnails)]
+		create_thumbnails(orig, thumbnails)
+		return sum(os.path.getsize(thumbnail.dest) for thumbnail in thumbnails)
+
+
+class Command(BaseCommand):
+	help = 'Create the existing thumbnails of the images again, with the current encoder options of their formats, ' \
+		'in parallel, and report the bytes saved. Missing thumbnails are left to generate_thumbnails.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('albums', nargs='*', metavar='album',
+			help='Path of album (like in the url) to re-encode the thumbnails of, including its sub-albums. '
+				'All albums if not given.')
+		parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+			help='Number of processes rendering thumbnails. Defaults to the number of CPUs.')
+		parser.add_argument('-n', '--dry-run', action='store_true',
+			help='Only report the bytes that would be saved, rendering into a temporary directory.')
+
+	def handle(self, *args, albums, jobs, dry_run, **options):
+		thumbnails = {}  # by original, with their current total size
+		encodings = get_encodings()
+		for image in get_images(album.strip('/') for album in albums):
+			existing: List[Tuple] = []
+			size = 0
+			for thumbnail_format in get_thumbnail_formats(image):
+				for encoding in encodings:
+					path = get_thumbnail_file(image, thumbnail_format, encoding)
+					try:
+						size += path.stat().st_size
+					except FileNotFoundError:
+						continue
+					existing.append((thumbnail_format, encoding, path))
+			if existing:
+				thumbnails[image.file.path] = (get_thumbnails(existing), size)
+		total = sum(len(image_thumbnails) for image_thumbnails, _ in thumbnails.values())
+		if not total:
+			self.stdout.write('No thumbnails to re-encode')
+			return
+
+		# Connections can't be shared with the forked processes, and are not needed there.
+		connections.close_all()
+		done = failed = 0
+		before = after = 0
+		start = last_report = time.monotonic()
+		with ProcessPoolExecutor(max_workers=jobs) as executor:
+			futures = {executor.submit(_reencode, orig, image_thumbnails, dry_run): (orig, len(image_thumbnails), size)
+				for orig, (image_thumbnails, size) in thumbnails.items()}
+			for future in as_completed(futures):
+				orig, count, size = futures[future]
+				try:
+					after += future.result()
+					before += size
+					done += count
+				except Exception as e:
+					failed += count
+					self.stderr.write('Cannot re-encode thumbnails of {}: {}'.format(orig, e))
+				now = time.monotonic()
+				if now - last_report >= 1 or done + failed == total:
+					last_report = now
+					self.stdout.write('[{}/{}] {:.1f} thumbnails/s'.format(
+						done + failed, total, (done + failed) / (now - start)))
+		self.stdout.write('{} {} thumbnails in {:.1f}s, {} failed: {:,} bytes to {:,} bytes, {} {:,} bytes ({:.1f}%)'.format(
+			'Would re-encode' if dry_run else 'Re-encoded', done, time.monotonic() - start, failed,
+			before, after, 'saving' if after <= before else 'adding', abs(before - after),
+			abs(before - after) / before * 100 if before else 0))
@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from multiprocessing.synchronize import Event
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from ... import jobs, uploads
+
+# Seconds between requeueing jobs of killed workers, removing old jobs and expiring unfinished uploads
+_CLEAN_UP_INTERVAL = 60
+
+
+def _work(number: int, stop: Event, poll_interval: float, once: bool) -> None:
+	""" Execute jobs until stopped, or until the queue is empty if `once' is given. """
+	# finish the current job on termination
+	signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+	signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+	worker = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), number)
+	last_clean_up = 0.0
+	while not stop.is_set():
+		if number == 0 and time.monotonic() - last_clean_up >= _CLEAN_UP_INTERVAL:
+			jobs.clean_up()
+			uploads.expire_uploads(settings.UPLOADS_EXPIRE)
+			last_clean_up = time.monotonic()
+		job = jobs.claim(worker)
+		if job:
+			jobs.run(job)
+		elif once:
+			break
+		else:
+			stop.wait(poll_interval)
+
+
+class Command(BaseCommand):
+	help = 'Execute background jobs from the job queue, by a pool of worker processes.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('-j', '--processes', type=int, default=os.cpu_count(),
+			help='Number of worker processes. Defaults to the number of CPUs.')
+		parser.add_argument('-p', '--poll-interval', type=float, default=1.0,
+			help='Seconds to wait before looking for new jobs, when the queue is empty. Default 1.')
+		parser.add_argument('--once', action='store_true', help='Stop when the queue is empty.')
+
+	def handle(self, *args, processes, poll_interval, once, **options):
+		# Connections can't be shared with the forked processes
+		connections.close_all()
+		stop = multiprocessing.Event()
+		workers = [multiprocessing.Process(target=_work, args=(i, stop, poll_interval, once), name='worker-{}'.format(i))
+			for i in range(processes)]
+		for worker in workers:
+			worker.start()
+		signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+		signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+		for worker in workers:
+			worker.join()
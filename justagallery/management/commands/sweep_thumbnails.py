@@ -0,0 +1,73 @@
+import os
+import re
+from pathlib import Path
+from typing import List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...thumbnails import get_orphaned_thumbnails, iter_thumbnail_files
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def _parse_size(size: str) -> int:
+	""" Number of bytes of a size like 500M or 20G """
+	match = re.fullmatch(r'(\d+)([KMGT]?)B?', size.strip().upper())
+	if not match:
+		raise CommandError('Invalid size: {}'.format(size))
+	return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+class Command(BaseCommand):
+	help = 'Remove thumbnails that no longer belong to an image or to one of the formats it is shown in. ' \
+		'Optionally remove the least recently accessed thumbnails until they fit in a quota. ' \
+		'Thumbnails removed are recreated when requested.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('-q', '--quota', type=_parse_size,
+			help='Maximum total size of the thumbnails, like 500M or 20G. The least recently accessed ones are '
+				'removed when exceeded. Relies on access times, which are updated at most daily with the common '
+				'relatime mount option.')
+		parser.add_argument('-n', '--dry-run', action='store_true',
+			help='Only report the thumbnails that would be removed.')
+
+	def handle(self, *args, quota, dry_run, **options):
+		count, size = self._remove(get_orphaned_thumbnails(), dry_run, options['verbosity'])
+		self.stdout.write('{} {} orphaned thumbnails ({:.1f} MiB)'.format(
+			'Would remove' if dry_run else 'Removed', count, size / 1024 ** 2))
+		if quota is None:
+			return
+
+		thumbnails: List[Tuple[float, int, Path]] = []
+		for path in iter_thumbnail_files():
+			try:
+				stat = path.stat()
+			except FileNotFoundError:
+				continue
+			thumbnails.append((stat.st_atime, stat.st_size, path))
+		total = sum(size for _, size, _ in thumbnails)
+		evict = []
+		for _, size, path in sorted(thumbnails):  # least recently accessed first
+			if total <= quota:
+				break
+			evict.append(path)
+			total -= size
+		count, size = self._remove(evict, dry_run, options['verbosity'])
+		self.stdout.write('{} {} least recently accessed thumbnails ({:.1f} MiB), {:.1f} MiB left'.format(
+			'Would evict' if dry_run else 'Evicted', count, size / 1024 ** 2, total / 1024 ** 2))
+
+	def _remove(self, paths, dry_run: bool, verbosity: int) -> Tuple[int, int]:
+		""" :return: number and total size of the files removed """
+		count = size = 0
+		for path in paths:
+			try:
+				file_size = path.stat().st_size
+				if not dry_run:
+					os.unlink(path)
+			except FileNotFoundError:
+				continue
+			count += 1
+			size += file_size
+			if verbosity > 1:
+				self.stdout.write(str(path))
+		return count, size
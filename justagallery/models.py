@@ -1,14 +1,23 @@
 import os
 import logging
+import uuid
 from datetime import datetime
-from typing import TypeVar, Union, Iterator, Sized, Type, Generic
+from typing import TypeVar, Union, Iterator, Sized, Type, Generic, Dict, Any, Optional, Tuple, FrozenSet, List, \
+	Iterable, Set
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Q
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
+from django.db.models import Q, Value, Exists, OuterRef, F, Count, Sum, Subquery
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
 
+from . import jobs
 from .domain import entities
-from .domain.image import get_size
+from .domain.image import SUBSAMPLINGS, get_size
+from .domain.url import get_path_by_category
 
 T = TypeVar('T', bound=models.Model)
 
@@ -28,11 +37,42 @@ class Repository(entities.Repository[T]):
 		return self.model.objects.filter(**kwargs)
 
 
+class _TrackLoadedValuesMixin:
+	""" Remembers the values as loaded from the database, to be able to detect changes on save. """
+	_loaded_values: Dict[str, Any] = {}
+
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		instance._loaded_values = dict(zip(field_names, values))
+		return instance
+
+	def _reset_loaded_values(self):
+		""" Mark current values as loaded, to be called after saving. """
+		self._loaded_values = {f.attname: getattr(self, f.attname) for f in self._meta.concrete_fields}
+
+	def _has_changed(self, *attnames: str) -> bool:
+		""" Whether any of the given attributes differ from the loaded values. Always True if not loaded. """
+		if not self._loaded_values:
+			return True
+		return any(attname not in self._loaded_values or self._loaded_values[attname] != getattr(self, attname)
+			for attname in attnames)
+
+
 class ThumbnailFormat(models.Model, entities.ThumbnailFormat):
 	id = models.AutoField(primary_key=True)
 	width = models.IntegerField()
 	height = models.IntegerField()
 	crop = models.BooleanField(default=False)
+	quality = models.PositiveSmallIntegerField(blank=True, null=True,
+		validators=[MinValueValidator(1), MaxValueValidator(100)],
+		help_text='Quality of 1 to 100, in every encoding. Empty for the default of each encoding.')
+	progressive = models.BooleanField(default=False, help_text='Progressive JPEG, showing coarse first while loading.')
+	optimize = models.BooleanField(default=False, help_text='Optimized Huffman coding of JPEG, somewhat smaller.')
+	subsampling = models.CharField(max_length=5, blank=True, default='',
+		choices=[('', 'Default')] + [(subsampling, subsampling) for subsampling in SUBSAMPLINGS],
+		help_text='Chroma subsampling of JPEG and AVIF. 4:4:4 keeps colors sharp, 4:2:0 is smallest.')
+	strip_metadata = models.BooleanField(default=True, help_text='Leave out EXIF and the ICC profile of the original.')
 
 	class Meta:
 		db_table = 'thumbnail_formats'
@@ -45,11 +85,31 @@ class ThumbnailFormat(models.Model, entities.ThumbnailFormat):
 		)
 
 
-class Category(models.Model, entities.Category):
+class _Below(models.Lookup):
+	"""
+		`path__below': the paths below a path, starting with it and a slash. Compared exactly,
+		unlike `startswith', which is a LIKE ignoring case on SQLite.
+	"""
+	lookup_name = 'below'
+
+	def as_sql(self, compiler, connection):
+		lhs, lhs_params = self.process_lhs(compiler, connection)
+		prefix = self.rhs + '/'
+		return 'SUBSTR({}, 1, %s) = %s'.format(lhs), [*lhs_params, len(prefix), prefix]
+
+
+class PathField(models.CharField):
+	""" Materialized path of a category, the slugs of its parents and itself joined by slashes """
+
+PathField.register_lookup(_Below)
+
+
+class Category(_TrackLoadedValuesMixin, models.Model, entities.Category):
 	id = models.AutoField(primary_key=True)
 	parent = models.ForeignKey('self', on_delete=models.RESTRICT, related_name='children', blank=True, null=True)
 	title = models.CharField(max_length=255)
 	slug = models.CharField(max_length=255)
+	path = PathField(max_length=1024, editable=False, default='')
 	description = models.TextField()
 	created_at = models.DateTimeField(default=datetime.now)
 	updated_at = models.DateTimeField(default=datetime.now)
@@ -63,24 +123,61 @@ class Category(models.Model, entities.Category):
 	hidden = models.BooleanField(default=False)
 	private = models.BooleanField(default=False)
 	sequence = models.IntegerField(default=0)
+	page_size = models.PositiveIntegerField(blank=True, null=True,
+		help_text='Number of images per page. Empty for the default.')
+	# Effective settings, inherited from the parents. Maintained by _save_effective_settings().
+	private_owner = models.ForeignKey(User, on_delete=models.RESTRICT, blank=True, null=True, editable=False,
+		related_name='+')
+	effective_thumbnail_format = models.ForeignKey(ThumbnailFormat, on_delete=models.SET_NULL, blank=True,
+		null=True, editable=False, related_name='+')
+	effective_hidden = models.BooleanField(default=False, editable=False)  # the category or any parent hidden
+	effective_thumbnail_formats = models.ManyToManyField(ThumbnailFormat, related_name='+', editable=False)
+	effective_display_formats = models.ManyToManyField(ThumbnailFormat, related_name='+', editable=False)
+	# Statistics, including the categories below. Maintained by add_statistics() and save_covers().
+	image_count = models.IntegerField(default=0, editable=False)  # of the category itself
+	total_image_count = models.IntegerField(default=0, editable=False)
+	total_bytes = models.BigIntegerField(default=0, editable=False)  # of the original images
+	cover_image = models.ForeignKey('Image', on_delete=models.SET_NULL, blank=True, null=True, editable=False,
+		related_name='+')  # see _resolve_covers()
+
+	STATISTICS = ('image_count', 'total_image_count', 'total_bytes', 'cover_image')
+	EFFECTIVE_SETTINGS = ('private_owner', 'effective_thumbnail_format', 'effective_hidden')
 
 	def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
 		self.updated_at = datetime.now()
 		_save_sequence(self)
-		super().save(force_insert, force_update, using, update_fields)
+		created = self._state.adding
+		if not created and update_fields is None:
+			# statistics and effective settings are updated in the database only, by changes of this or
+			# other categories, the values of this instance can be outdated
+			update_fields = [f.name for f in self._meta.concrete_fields if not f.primary_key
+				and f.name not in Category.STATISTICS and f.name not in Category.EFFECTIVE_SETTINGS]
+		old_path, old_parent_id = self._loaded_values.get('path'), self._loaded_values.get('parent_id')
+		with transaction.atomic(using=using):
+			_save_path(self)
+			super().save(force_insert, force_update, using, update_fields)
+			if self._has_changed('parent_id', 'hidden', 'private', 'owner_id', 'default_thumbnail_format_id'):
+				_save_effective_settings(self)
+			if not created and self._has_changed('parent_id', 'default_thumbnail_format_id'):
+				_render_thumbnails(self)
+			if not created and old_path and self._has_changed('parent_id'):
+				_move_statistics(self, old_path)
+			if not created and self._has_changed('parent_id', 'default_image_id', 'sequence'):
+				save_covers([self.id] + ([old_parent_id] if old_parent_id else []))
+		self._reset_loaded_values()
 
 	def __str__(self):
 		return self.title
 
 	class Meta:
 		indexes = [models.Index(fields=['slug']), models.Index(fields=['created_at']),
-			models.Index(fields=['sequence'])]
+			models.Index(fields=['sequence']), models.Index(fields=['path'])]
 		db_table = 'categories'
 		unique_together = ('parent', 'slug')
 		ordering = ('sequence',)
 
 
-class Image(models.Model, entities.Image):
+class Image(_TrackLoadedValuesMixin, models.Model, entities.Image):
 	id = models.AutoField(primary_key=True)
 	category = models.ForeignKey(Category, on_delete=models.RESTRICT, related_name='images')
 	title = models.CharField(max_length=255, blank=True)
@@ -95,15 +192,26 @@ class Image(models.Model, entities.Image):
 	sequence = models.IntegerField(default=0)
 	width = models.IntegerField(default=0)
 	height = models.IntegerField(default=0)
+	has_display_formats = models.BooleanField(default=False, editable=False)  # maintained on change of display_formats
+	filesize = models.BigIntegerField(default=0, editable=False)  # of the original, in bytes
 
 	def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
 		self.updated_at = datetime.now()
+		process = not self.id or not self.file._committed
+		created = not self.id
 		if not self.file._committed:  # new file uploaded
-			# first retrieve width and height from temporary file
-			self.width, self.height = get_size(self.file.file.file.name)
+			if settings.JOBS_ENABLED:
+				# width and height are retrieved by the process_image job
+				self.width = self.height = 0
+			else:
+				# first retrieve width and height from temporary file
+				self.width, self.height = get_size(self.file.file.file.name)
 			# upload file now, to get the definitive unique file name, necessary for the slug
 			self._meta.get_field('file').pre_save(self, None)
 			self.slug = os.path.basename(self.file.path)
+			self.filesize = self.file.size
+		elif created and not self.filesize and self.file:  # file stored before, like of a chunked upload
+			self.filesize = self.file.size
 		if not self.id: # on creation of record
 			if not self.title:
 				# derive title from slug (filename)
@@ -112,30 +220,83 @@ class Image(models.Model, entities.Image):
 				# derive description from title
 				self.description = self.title
 		_save_sequence(self)
-		super().save(force_insert, force_update, using, update_fields)
+		old_category_id, old_filesize = self._loaded_values.get('category_id'), self._loaded_values.get('filesize', 0)
+		with transaction.atomic(using=using):
+			super().save(force_insert, force_update, using, update_fields)
+			if created:
+				add_statistics(self.category_id, 1, self.filesize)
+			elif old_category_id and old_category_id != self.category_id:
+				add_statistics(old_category_id, -1, -old_filesize)
+				add_statistics(self.category_id, 1, self.filesize)
+			elif old_category_id and old_filesize != self.filesize:
+				add_statistics(self.category_id, 0, self.filesize - old_filesize)
+			if created or self._has_changed('category_id', 'sequence'):
+				save_covers({self.category_id, old_category_id or self.category_id})
+			if self._loaded_values and self._has_changed('category_id', 'slug'):
+				# thumbnails of replaced file, or in the directory of the previous category
+				jobs.enqueue('delete_thumbnails', category_id=self._loaded_values['category_id'],
+					slug=self._loaded_values['slug'])
+		self._reset_loaded_values()
+		if process and settings.JOBS_ENABLED:
+			jobs.enqueue('process_image', image_id=self.id)
 
 	def __str__(self):
 		return self.title
 
-	def delete(self, using=None, keep_parents=False):
-		# Remove file on deletion of record.
-		# This could be implemented much better using the storage backend delete,
-		# signalling, using transactions, and what more. For now, this is Good Enough.
-		path = self.file.path
-		ret = super().delete(using, keep_parents)
-		try:
-			os.unlink(path)
-		except Exception as e:
-			logger.warning('Cannot remove file {}: {}'.format(path, e))
-		return ret
-
 	class Meta:
 		indexes = [models.Index(fields=['slug']), models.Index(fields=['created_at']),
-			models.Index(fields=['sequence'])]
+			models.Index(fields=['sequence']), models.Index(fields=['category', 'sequence', 'id'])]
 		db_table = 'images'
 		unique_together = ('category', 'slug')
 		ordering = ('sequence',)
 
+
+class Upload(models.Model):
+	""" Image being uploaded in chunks, staged in MEDIA_ROOT until it is complete, see uploads.py """
+	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+	category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+	owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+	filename = models.CharField(max_length=255)
+	size = models.BigIntegerField()
+	offset = models.BigIntegerField(default=0)  # number of bytes received
+	width = models.IntegerField(default=0)  # known as soon as the header is received
+	height = models.IntegerField(default=0)
+	created_at = models.DateTimeField(default=datetime.now)
+	updated_at = models.DateTimeField(default=datetime.now)
+
+	class Meta:
+		db_table = 'uploads'
+
+
+class Job(models.Model):
+	""" Job in the background job queue, see jobs.py """
+	QUEUED = 'queued'
+	RUNNING = 'running'
+	DONE = 'done'
+	DEAD = 'dead'  # failed too many times
+	STATES = ((QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (DEAD, 'Dead'))
+
+	id = models.BigAutoField(primary_key=True)
+	name = models.CharField(max_length=255)  # of the handler
+	kwargs = models.JSONField(default=dict)
+	state = models.CharField(max_length=16, choices=STATES, default=QUEUED)
+	attempts = models.IntegerField(default=0)
+	max_attempts = models.IntegerField(default=1)
+	run_after = models.DateTimeField(default=datetime.now)
+	worker = models.CharField(max_length=255, blank=True)
+	error = models.TextField(blank=True)
+	created_at = models.DateTimeField(default=datetime.now)
+	started_at = models.DateTimeField(blank=True, null=True)
+	finished_at = models.DateTimeField(blank=True, null=True)
+	duration = models.FloatField(blank=True, null=True)  # in seconds, of the last attempt
+
+	def __str__(self):
+		return '{}({})'.format(self.name, ', '.join('{}={!r}'.format(k, v) for k, v in self.kwargs.items()))
+
+	class Meta:
+		indexes = [models.Index(fields=['state', 'run_after'])]
+		db_table = 'jobs'
+
 def _save_sequence(instance: Union[Category, Image]):
 	"""
 		Calculates sequence, based on category of instance and the previous sequence,
@@ -152,3 +313,273 @@ def _save_sequence(instance: Union[Category, Image]):
 		else:
 			prev_sequence = 0
 		instance.sequence = prev_sequence + 10
+
+def _save_path(instance: Category):
+	"""
+		Calculates the materialized path of the category and sets it on the instance.
+		If the path changed, the paths of all categories below it are updated as well.
+	"""
+	if instance.pk and 'path' not in instance._loaded_values:
+		old_path = Category.objects.filter(pk=instance.pk).values_list('path', flat=True).first()
+	else:
+		old_path = instance._loaded_values.get('path')
+	instance.path = get_path_by_category(instance)
+	if old_path and old_path != instance.path:
+		Category.objects.filter(path__below=old_path).update(
+			path=Concat(Value(instance.path), Substr('path', len(old_path) + 1)))
+
+def rebuild_paths():
+	""" Recalculates the materialized paths of all categories, top-down. """
+	categories = {c.id: c for c in Category.objects.only('id', 'parent_id', 'slug', 'path')}
+	paths: Dict[int, str] = {}
+	def path(category: Category) -> str:
+		if category.id not in paths:
+			if category.parent_id:
+				paths[category.id] = "{}/{}".format(path(categories[category.parent_id]), category.slug)
+			else:
+				paths[category.id] = category.slug
+		return paths[category.id]
+	changed = []
+	for category in categories.values():
+		if category.path != path(category):
+			category.path = path(category)
+			changed.append(category)
+	Category.objects.bulk_update(changed, ['path'], batch_size=500)
+	return len(changed)
+
+# Effective settings of a category: private owner, hidden, default thumbnail formats (nearest first), display formats
+_EffectiveSettings = Tuple[Optional[int], bool, Tuple[int, ...], FrozenSet[int]]
+
+def _save_effective_settings(category: Category):
+	"""
+		Calculates the effective settings, inherited from the parents, of the category and all
+		categories below it, and stores them. See domain.category for their meaning.
+	"""
+	subtree: List[Category] = [category] + list(
+		Category.objects.filter(path__below=category.path).order_by('path'))  # parents first
+	subtree_q = Q(category=category) | Q(category__path__below=category.path)
+
+	display_formats: Dict[int, List[int]] = {}
+	for category_id, format_id in Category.display_formats.through.objects.filter(subtree_q) \
+			.values_list('category_id', 'thumbnailformat_id'):
+		display_formats.setdefault(category_id, []).append(format_id)
+
+	settings: Dict[int, _EffectiveSettings] = {}
+	if category.parent_id:
+		parent = Category.objects.get(pk=category.parent_id)
+		settings[parent.id] = (
+			parent.private_owner_id,
+			parent.effective_hidden,
+			tuple(Category.effective_thumbnail_formats.through.objects.filter(category_id=parent.id)
+				.order_by('id').values_list('thumbnailformat_id', flat=True)),
+			frozenset(parent.effective_display_formats.values_list('id', flat=True)),
+		)
+
+	effective_thumbnail_formats = []
+	effective_display_formats = []
+	for c in subtree:
+		parent_owner, parent_hidden, parent_chain, parent_display_formats = settings.get(c.parent_id,
+			(None, False, (), frozenset()))
+		chain = parent_chain
+		if c.default_thumbnail_format_id:
+			chain = (c.default_thumbnail_format_id,) + tuple(id for id in chain if id != c.default_thumbnail_format_id)
+		settings[c.id] = (
+			c.owner_id if c.private else parent_owner,
+			c.hidden or parent_hidden,
+			chain,
+			frozenset(display_formats[c.id]) if c.id in display_formats else parent_display_formats,
+		)
+		c.private_owner_id, c.effective_hidden = settings[c.id][:2]
+		c.effective_thumbnail_format_id = next(iter(chain), None)
+		effective_thumbnail_formats += [Category.effective_thumbnail_formats.through(  # in order of the chain
+			category_id=c.id, thumbnailformat_id=format_id) for format_id in chain]
+		effective_display_formats += [Category.effective_display_formats.through(
+			category_id=c.id, thumbnailformat_id=format_id) for format_id in settings[c.id][3]]
+
+	Category.objects.bulk_update(subtree, ['private_owner', 'effective_hidden', 'effective_thumbnail_format'],
+		batch_size=500)
+	for through, rows in ((Category.effective_thumbnail_formats.through, effective_thumbnail_formats),
+			(Category.effective_display_formats.through, effective_display_formats)):
+		through.objects.filter(subtree_q).delete()
+		through.objects.bulk_create(rows, batch_size=500)
+
+def _save_has_display_formats(image_ids: Optional[List[int]] = None):
+	""" Stores whether the images (all if not given) have display formats of their own. """
+	images = Image.objects.all() if image_ids is None else Image.objects.filter(pk__in=image_ids)
+	images.update(has_display_formats=Exists(
+		Image.display_formats.through.objects.filter(image_id=OuterRef('pk'))))
+
+def _render_thumbnails(category: Category):
+	""" Create the missing thumbnails of the category and the categories below in the background, if enabled. """
+	if settings.JOBS_ENABLED:
+		jobs.enqueue('render_thumbnails', path=category.path)
+
+def rebuild_effective_settings():
+	""" Recalculates the effective settings of all categories and images. """
+	for category in Category.objects.filter(parent=None):
+		_save_effective_settings(category)
+	_save_has_display_formats()
+
+@receiver(m2m_changed, sender=Category.display_formats.through)
+def _category_display_formats_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+	if action not in ('post_add', 'post_remove', 'post_clear'):
+		return
+	if not reverse:
+		_save_effective_settings(instance)
+		_render_thumbnails(instance)
+	elif pk_set is None:
+		rebuild_effective_settings()
+	else:
+		for category in Category.objects.filter(pk__in=pk_set):
+			_save_effective_settings(category)
+			_render_thumbnails(category)
+
+@receiver(m2m_changed, sender=Image.display_formats.through)
+def _image_display_formats_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+	if action not in ('post_add', 'post_remove', 'post_clear'):
+		return
+	if not reverse:
+		_save_has_display_formats([instance.pk])
+		image_ids = [instance.pk]
+	else:
+		_save_has_display_formats(None if pk_set is None else list(pk_set))
+		image_ids = list(pk_set or ())
+	if settings.JOBS_ENABLED:
+		jobs.enqueue_many('process_image', [dict(image_id=image_id) for image_id in image_ids])
+
+@receiver(pre_delete, sender=Image)
+def _image_deleting(sender, instance: Image, **kwargs):
+	# the categories it's the cover of, also in other trees as a default image, before their covers are set to null
+	instance._cover_of = list(Category.objects.filter(cover_image=instance).values_list('id', flat=True))
+
+@receiver(post_delete, sender=Image)
+def _image_deleted(sender, instance: Image, **kwargs):
+	""" Remove the files of the image, and it from the statistics, also on deletion in bulk. """
+	jobs.enqueue('delete_file', path=instance.file.path)
+	jobs.enqueue('delete_thumbnails', category_id=instance.category_id, slug=instance.slug)
+	add_statistics(instance.category_id, -1, -instance.filesize)
+	save_covers([instance.category_id, *getattr(instance, '_cover_of', ())])
+
+def _get_paths_up(path: str) -> List[str]:
+	""" Paths of the categories above the category with the path, from the top, and the path itself. """
+	parts = path.split('/')
+	return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+def add_statistics(category_id: int, images: int, bytes: int) -> None:
+	""" Add images (or remove, if negative) with a total size of `bytes' to the statistics of the category. """
+	path = Category.objects.filter(pk=category_id).values_list('path', flat=True).first()
+	if path is None:
+		return
+	Category.objects.filter(pk=category_id).update(image_count=F('image_count') + images)
+	Category.objects.filter(path__in=_get_paths_up(path)).update(
+		total_image_count=F('total_image_count') + images, total_bytes=F('total_bytes') + bytes)
+
+def _move_statistics(category: Category, old_path: str):
+	""" Move the totals of the moved category from the categories above its previous path to the current ones """
+	total_image_count, total_bytes = Category.objects.filter(pk=category.pk) \
+		.values_list('total_image_count', 'total_bytes').get()
+	for paths, sign in ((_get_paths_up(old_path)[:-1], -1), (_get_paths_up(category.path)[:-1], 1)):
+		Category.objects.filter(path__in=paths).update(total_image_count=F('total_image_count') + sign * total_image_count,
+			total_bytes=F('total_bytes') + sign * total_bytes)
+
+def _resolve_covers(categories: 'models.QuerySet[Category]') -> Dict[int, Optional[int]]:
+	"""
+		Resolve the cover images of the given categories, which must include all categories below them:
+		the default image of the category, otherwise the first default image of the categories below,
+		otherwise the first image of the category, otherwise the first image of the categories below.
+		Like domain.category.get_default_image, but skipping categories below without images.
+	"""
+	first_image = Image.objects.filter(category=OuterRef('pk')).order_by('sequence', 'id').values('id')[:1]
+	rows = categories.annotate(first_image_id=Subquery(first_image)).order_by('sequence', 'id') \
+		.values_list('id', 'parent_id', 'default_image_id', 'first_image_id')
+	default_image_ids: Dict[int, Optional[int]] = {}
+	first_image_ids: Dict[int, Optional[int]] = {}
+	children_ids: Dict[Optional[int], List[int]] = {}
+	for id, parent_id, default_image_id, first_image_id in rows:  # in order of sequence
+		default_image_ids[id] = default_image_id
+		first_image_ids[id] = first_image_id
+		children_ids.setdefault(parent_id, []).append(id)
+
+	def resolve(ids: Dict[int, Optional[int]], id: int) -> Optional[int]:
+		if ids[id]:
+			return ids[id]
+		return next((image_id for child_id in children_ids.get(id, []) if (image_id := resolve(ids, child_id))), None)
+
+	return {id: resolve(default_image_ids, id) or resolve(first_image_ids, id) for id in default_image_ids}
+
+def save_covers(category_ids: Iterable[int]):
+	"""
+		Resolve and store the cover images of the categories and the categories above them, like _resolve_covers,
+		from the bottom up. Only the categories changed and above them are resolved, from the stored covers of their
+		children, so the cost depends on the depth of the categories, not on the size of the tree.
+	"""
+	paths: Set[str] = set()
+	for path in Category.objects.filter(pk__in=list(category_ids)).values_list('path', flat=True):
+		paths.update(_get_paths_up(path))
+	if not paths:
+		return
+	rows = {path: (id, default_image_id, cover_image_id) for id, path, default_image_id, cover_image_id in
+		Category.objects.filter(path__in=paths).values_list('id', 'path', 'default_image_id', 'cover_image_id')}
+	# paths of the categories having a default image, in the trees changed
+	q = Q()
+	for root in {path.split('/')[0] for path in paths}:
+		q |= Q(path=root) | Q(path__below=root)
+	default_paths = list(Category.objects.filter(q).exclude(default_image=None).values_list('path', flat=True))
+
+	def has_default(path: str) -> bool:
+		""" Whether the cover of the category is a default image, of itself or a category below """
+		return any(default_path == path or default_path.startswith(path + '/') for default_path in default_paths)
+
+	covers: Dict[int, Optional[int]] = {}  # resolved so far, by category id
+	for path in sorted(rows, key=lambda path: path.count('/'), reverse=True):  # children first
+		id, default_image_id, cover_image_id = rows[path]
+		children = [(child_path, covers.get(child_id, child_cover_id)) for child_id, child_path, child_cover_id in
+			Category.objects.filter(parent_id=id).order_by('sequence', 'id').values_list('id', 'path', 'cover_image_id')]
+		cover = default_image_id or next((child_cover for child_path, child_cover in children
+			if child_cover and has_default(child_path)), None)
+		if not cover:
+			# no default images below, the covers of the children are their first images
+			cover = Image.objects.filter(category_id=id).order_by('sequence', 'id').values_list('id', flat=True) \
+				.first() or next((child_cover for _, child_cover in children if child_cover), None)
+		covers[id] = cover
+		if cover != cover_image_id:
+			Category.objects.filter(pk=id).update(cover_image_id=cover)
+
+def rebuild_statistics() -> int:
+	"""
+		Recalculates the statistics of all categories, and the file sizes of images not having one.
+		:return: the number of categories which statistics changed
+	"""
+	images = list(Image.objects.filter(filesize=0).only('id', 'file'))
+	for image in images:
+		try:
+			image.filesize = os.path.getsize(image.file.path)
+		except OSError as e:
+			logger.warning('Cannot read size of {}: {}'.format(image.file.path, e))
+	Image.objects.bulk_update(images, ['filesize'], batch_size=500)
+
+	categories = list(Category.objects.only('id', 'path', *Category.STATISTICS))
+	by_path = {category.path: category for category in categories}
+	counts = {row['category_id']: row for row in Image.objects.order_by().values('category_id')
+		.annotate(count=Count('id'), bytes=Sum('filesize'))}
+	statistics = {category.id: [0, 0, 0] for category in categories}  # image count, total count, total bytes
+	for category in categories:
+		row = counts.get(category.id, dict(count=0, bytes=0))
+		statistics[category.id][0] = row['count']
+		for path in _get_paths_up(category.path):
+			if path in by_path:
+				statistics[by_path[path].id][1] += row['count']
+				statistics[by_path[path].id][2] += row['bytes'] or 0
+	covers = _resolve_covers(Category.objects.all())
+	changed = []
+	for category in categories:
+		values = (*statistics[category.id], covers.get(category.id))
+		if values != (category.image_count, category.total_image_count, category.total_bytes, category.cover_image_id):
+			category.image_count, category.total_image_count, category.total_bytes, category.cover_image_id = values
+			changed.append(category)
+	Category.objects.bulk_update(changed, list(Category.STATISTICS), batch_size=500)
+	return len(changed)
+
+@receiver(post_delete, sender=ThumbnailFormat)
+def _thumbnail_format_deleted(sender, instance: ThumbnailFormat, **kwargs):
+	rebuild_effective_settings()
@@ -0,0 +1,132 @@
+"""
+	Cache of rendered pages of the index and the albums, in the Django cache PAGE_CACHE.
+	Pages are cached by url and visibility class (anonymous, or the logged in user). Every album, and
+	the index, has a generation in the cache which is part of the keys of its pages. A change of an
+	album or image replaces the generations of the albums showing it, so their cached pages are not
+	found anymore, and expire.
+	A hit saves rendering the page and loading what it shows, not every query: the album is still
+	looked up by its path, to check access to it, and the view is counted in the session of the user.
+"""
+import hashlib
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpRequest
+
+from . import models
+
+INDEX = ''  # path of the index, for its generation
+
+_GLOBAL_GENERATION = 'pagecache:generation'
+
+
+@dataclass
+class CachedPage:
+	content: bytes
+	content_type: str
+	etag: str
+	last_modified: Optional[int]  # timestamp
+
+
+def get_key(request: HttpRequest, path: str) -> Optional[str]:
+	"""
+		Key of the page at the url of the request, showing the album with the path (or INDEX), for
+		the visibility class of the user. None if the page cache is disabled.
+	"""
+	if not settings.PAGE_CACHE_TIMEOUT:
+		return None
+	visibility = 'anonymous' if request.user.is_anonymous else 'user-{}'.format(request.user.pk)
+	generations = _get_generations([_GLOBAL_GENERATION, _get_generation_key(path)])
+	return 'pagecache:page:{}:{}:{}'.format(visibility, ':'.join(generations),
+		hashlib.md5(request.get_full_path().encode()).hexdigest())
+
+
+def load(key: str) -> Optional[CachedPage]:
+	return _cache().get(key)
+
+
+def store(key: str, page: CachedPage) -> None:
+	_cache().set(key, page, settings.PAGE_CACHE_TIMEOUT)
+
+
+def invalidate(paths: Iterable[str]) -> None:
+	""" Invalidate the cached pages of the albums with the paths, or the index for INDEX. """
+	_cache().set_many({_get_generation_key(path): uuid.uuid4().hex for path in paths}, None)
+
+
+def invalidate_all() -> None:
+	_cache().set(_GLOBAL_GENERATION, uuid.uuid4().hex, None)
+
+
+def invalidate_categories(category_ids: Iterable[int]) -> None:
+	"""
+		Invalidate the pages of the categories, and of the categories above, which show their
+		cover image and counts, once committed.
+	"""
+	category_ids = list(category_ids)
+	transaction.on_commit(lambda: invalidate(_with_ancestors(
+		models.Category.objects.filter(id__in=category_ids).values_list('path', flat=True))))
+
+
+def _get_generations(keys: List[str]) -> List[str]:
+	cache = _cache()
+	generations = cache.get_many(keys)
+	for key in keys:
+		if key not in generations:
+			# unknown or evicted, a new generation makes sure no pages of an earlier one are found
+			cache.add(key, uuid.uuid4().hex, None)
+			generations[key] = cache.get(key)
+	return [generations[key] for key in keys]
+
+
+def _get_generation_key(path: str) -> str:
+	return 'pagecache:generation:{}'.format(hashlib.md5(path.encode()).hexdigest())
+
+
+def _with_ancestors(paths: Iterable[str]) -> Set[str]:
+	""" The paths, and the paths of the categories above them, without INDEX """
+	result = set()
+	for path in paths:
+		parts = path.split('/')
+		result.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+	return result
+
+
+def _cache() -> BaseCache:
+	return caches[settings.PAGE_CACHE]
+
+
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+def _category_changed(sender, instance: models.Category, signal, **kwargs):
+	# the category is shown on the pages of the categories above, and its title and settings on the pages below
+	old_path = instance._loaded_values.get('path')
+	old_parent_id = instance._loaded_values.get('parent_id', 0)
+
+	def invalidate_category():
+		paths = _with_ancestors([instance.path] + ([old_path] if old_path else []))
+		if signal is post_save:
+			paths.update(models.Category.objects.filter(path__below=instance.path)
+				.values_list('path', flat=True))
+		if instance.parent_id is None or old_parent_id is None:
+			paths.add(INDEX)
+		invalidate(paths)
+	transaction.on_commit(invalidate_category)
+
+
+@receiver(post_save, sender=models.Image)
+@receiver(post_delete, sender=models.Image)
+def _image_changed(sender, instance: models.Image, **kwargs):
+	invalidate_categories({instance.category_id, instance._loaded_values.get('category_id', instance.category_id)})
+
+
+@receiver(post_save, sender=models.ThumbnailFormat)
+@receiver(post_delete, sender=models.ThumbnailFormat)
+def _format_changed(sender, **kwargs):
+	transaction.on_commit(invalidate_all)
@@ -0,0 +1,216 @@
+"""
+	Full-text search over the titles and descriptions of categories and images. The index is kept
+	up to date on save and delete, by the backend of the SEARCH_BACKEND setting: a SQLite FTS5 table
+	by default on SQLite, otherwise a (slow) fallback searching the tables themselves.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import models
+from .domain import entities
+
+CATEGORY = 'category'
+IMAGE = 'image'
+
+SearchModel = Union[models.Category, models.Image]
+
+
+@dataclass
+class SearchResults:
+	items: List[SearchModel] = field(default_factory=list)  # in order of relevance
+	page: int = 1
+	has_next: bool = False
+
+
+class Backend:
+	""" Full-text index of categories and images. Results are (kind, id) pairs, kind being CATEGORY or IMAGE. """
+
+	def update(self, objects: Iterable[SearchModel]) -> None:
+		""" Add the objects to the index, or update them """
+
+	def remove(self, objects: Iterable[SearchModel]) -> None:
+		pass
+
+	def clear(self) -> None:
+		pass
+
+	def search(self, terms: List[str], limit: int) -> List[Tuple[str, int]]:
+		"""
+			Find categories and images having all terms (or words starting with them) in their title
+			or description, the most relevant first.
+		"""
+		...
+
+
+class Fts5Backend(Backend):
+	"""
+		Index in an SQLite FTS5 table, ranked by BM25 with titles weighing more than descriptions.
+		The table is created on migrate, or else on first use. The rowid is derived from the kind and id of an object,
+		so objects are updated and removed without a scan.
+	"""
+	TABLE = 'search_index'
+
+	def __init__(self):
+		self._created = False
+
+	def update(self, objects: Iterable[SearchModel]) -> None:
+		rows = [(_get_rowid(obj), obj.title, obj.description) for obj in objects]
+		if rows:
+			with self._cursor() as cursor:
+				cursor.executemany('INSERT OR REPLACE INTO {} (rowid, title, description) VALUES (%s, %s, %s)'
+					.format(self.TABLE), rows)
+
+	def remove(self, objects: Iterable[SearchModel]) -> None:
+		rowids = [(_get_rowid(obj),) for obj in objects]
+		if rowids:
+			with self._cursor() as cursor:
+				cursor.executemany('DELETE FROM {} WHERE rowid = %s'.format(self.TABLE), rowids)
+
+	def clear(self) -> None:
+		with self._cursor() as cursor:
+			cursor.execute('DELETE FROM {}'.format(self.TABLE))
+
+	def search(self, terms: List[str], limit: int) -> List[Tuple[str, int]]:
+		# every term quoted, so it's not taken as FTS5 syntax, matching as prefix and ranking whole words higher
+		query = ' AND '.join('("{0}" OR "{0}"*)'.format(term.replace('"', '""')) for term in terms)
+		with self._cursor() as cursor:
+			cursor.execute('SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, 10.0, 1.0) LIMIT %s'
+				.format(self.TABLE), [query, limit])
+			return [(IMAGE if rowid % 2 else CATEGORY, rowid // 2) for rowid, in cursor.fetchall()]
+
+	def create_table(self) -> None:
+		with connection.cursor() as cursor:
+			cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(title, description, "
+				"tokenize='unicode61 remove_diacritics 2')".format(self.TABLE))
+		self._created = True
+
+	def _cursor(self):
+		if not self._created:
+			self.create_table()
+		return connection.cursor()
+
+
+class OrmBackend(Backend):
+	""" Without an index, searching the tables by `icontains', ranking matches in titles first. """
+
+	def search(self, terms: List[str], limit: int) -> List[Tuple[str, int]]:
+		results = []
+		for kind, model in ((CATEGORY, models.Category), (IMAGE, models.Image)):
+			q = Q()
+			in_title = Q()
+			for term in terms:
+				q &= Q(title__icontains=term) | Q(description__icontains=term)
+				in_title &= Q(title__icontains=term)
+			ids = list(model.objects.filter(q).values_list('id', flat=True)[:limit])
+			title_ids = set(model.objects.filter(in_title, id__in=ids).values_list('id', flat=True))
+			results += [(0 if id in title_ids else 1, kind, id) for id in ids]
+		return [(kind, id) for _, kind, id in sorted(results, key=lambda result: result[0])][:limit]
+
+
+_backend: Optional[Backend] = None
+
+
+def get_backend() -> Backend:
+	global _backend
+	if _backend is None:
+		if settings.SEARCH_BACKEND:
+			_backend = import_string(settings.SEARCH_BACKEND)()
+		else:
+			_backend = Fts5Backend() if connection.vendor == 'sqlite' else OrmBackend()
+	return _backend
+
+
+def search(query: str, user: entities.User, page: int = 1, page_size: int = 20) -> SearchResults:
+	"""
+		Search the categories and images the user may see, as shown by the views, returning the
+		given page of results. At most SEARCH_MAX_RESULTS results are found.
+	"""
+	terms = re.findall(r'\w+', query)
+	if not terms or page < 1:
+		return SearchResults(page=page)
+	found = get_backend().search(terms, settings.SEARCH_MAX_RESULTS)
+
+	# filter on visibility, with the ids only, and load the objects of the page only
+	ids: Dict[str, List[int]] = {CATEGORY: [], IMAGE: []}
+	for kind, id in found:
+		ids[kind].append(id)
+	visible = {(CATEGORY, id) for id in models.Category.objects.filter(get_visible_q(user), id__in=ids[CATEGORY])
+		.values_list('id', flat=True)}
+	visible.update((IMAGE, id) for id in models.Image.objects.filter(get_visible_q(user, 'category__'),
+		id__in=ids[IMAGE]).values_list('id', flat=True))
+	found = [result for result in found if result in visible]
+	page_results = found[(page - 1) * page_size:page * page_size]
+
+	objects: Dict[Tuple[str, int], SearchModel] = {}
+	page_ids = {kind: [id for result_kind, id in page_results if result_kind == kind] for kind in (CATEGORY, IMAGE)}
+	if page_ids[CATEGORY]:
+		objects.update(((CATEGORY, category.id), category) for category in models.Category.objects
+			.filter(id__in=page_ids[CATEGORY]).select_related('effective_thumbnail_format', 'cover_image__category'))
+	if page_ids[IMAGE]:
+		objects.update(((IMAGE, image.id), image) for image in models.Image.objects
+			.filter(id__in=page_ids[IMAGE]).select_related('category__effective_thumbnail_format'))
+	return SearchResults(items=[objects[result] for result in page_results if result in objects], page=page,
+		has_next=len(found) > page * page_size)
+
+
+def index(objects: Iterable[SearchModel]) -> None:
+	""" Add the objects to the index, or update them, for objects saved without signals. """
+	get_backend().update(objects)
+
+
+def get_visible_q(user: entities.User, prefix: str = '') -> Q:
+	"""
+		Condition on categories (or on the categories of images, with prefix 'category__') to be shown to
+		the user: listed like views.filter_categories, not below a hidden category, and accessible like
+		domain.category.is_private.
+	"""
+	listed = Q(**{prefix + 'effective_hidden': False, prefix + 'private': False})
+	accessible = Q(**{prefix + 'private_owner': None})
+	if user and not user.is_anonymous:
+		listed |= Q(**{prefix + 'owner': user})
+		accessible |= Q(**{prefix + 'private_owner': user})
+	return listed & accessible
+
+
+def rebuild_index() -> int:
+	""" Index all categories and images again. :return: number of objects indexed """
+	backend = get_backend()
+	backend.clear()
+	count = 0
+	for model in (models.Category, models.Image):
+		objects = list(model.objects.only('id', 'title', 'description'))
+		backend.update(objects)
+		count += len(objects)
+	return count
+
+
+def _get_rowid(obj: SearchModel) -> int:
+	return obj.id * 2 + (1 if isinstance(obj, models.Image) else 0)
+
+
+@receiver(post_save, sender=models.Category)
+@receiver(post_save, sender=models.Image)
+def _saved(sender, instance: SearchModel, created: bool, **kwargs):
+	if created or instance._has_changed('title', 'description'):
+		get_backend().update([instance])
+
+
+@receiver(post_delete, sender=models.Category)
+@receiver(post_delete, sender=models.Image)
+def _deleted(sender, instance: SearchModel, **kwargs):
+	get_backend().remove([instance])
+
+
+@receiver(post_migrate)
+def _migrated(sender, **kwargs):
+	# with the other tables, instead of in a transaction that could roll back the table (like of a test case)
+	if sender.name == 'justagallery' and isinstance(get_backend(), Fts5Backend):
+		get_backend().create_table()
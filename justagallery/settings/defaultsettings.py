@@ -130,8 +130,100 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# Files of images being uploaded in chunks by the API. Keep it out of MEDIA_ROOT, which is served, and on the
+# same file system, so a complete upload is moved in place instead of copied.
+UPLOADS_STAGING_ROOT = BASE_DIR / 'staging'
+
+# Seconds after the last chunk received, after which an unfinished upload is removed, by `manage.py run_jobs'
+# or `manage.py expire_uploads'
+UPLOADS_EXPIRE = 24 * 3600
+
 THUMBNAILS_ROOT = BASE_DIR / 'thumbnails'
 
+# Encodings of thumbnails besides JPEG, 'webp' and/or 'avif', in order of preference. Thumbnails are created
+# in every encoding supported by the IMAGE_BACKEND, and sent in the first one the browser accepts, JPEG if none.
+THUMBNAILS_ENCODINGS = ['webp']
+
+# Requests for thumbnails that can't exist are remembered for THUMBNAILS_MISSING_TTL seconds, to be rejected
+# without queries. At most THUMBNAILS_MISSING_MAX of them are remembered per process.
+THUMBNAILS_MISSING_TTL = 300
+
+THUMBNAILS_MISSING_MAX = 10000
+
+# Let the front-end web server send thumbnails, instead of Django: 'X-Accel-Redirect' for nginx (see
+# nginx.example.conf), or 'X-Sendfile' for Apache (mod_xsendfile) and lighttpd. None to send them by Django.
+THUMBNAILS_SENDFILE = None
+
+# URL of the internal nginx location serving THUMBNAILS_ROOT, used with X-Accel-Redirect
+THUMBNAILS_ACCEL_REDIRECT_URL = '/_thumbnails/'
+
+# Implementation of domain.image.Image, creating thumbnails. Use 'justagallery.domain._vips.Image'
+# for libvips, which is faster and uses less memory on large images (requires pyvips).
+IMAGE_BACKEND = 'justagallery.domain._pil.Image'
+
+# Cache-Control directives per view, as arguments of django.utils.cache.patch_cache_control. Pages carry an
+# ETag and Last-Modified, so clients can cheaply revalidate them. Responses of private albums, and pages for
+# logged in users, are always marked private. Thumbnail urls shown on pages are versioned, the thumbnail at
+# the url of the current version of its image never changes. Urls of other versions are served like unversioned.
+CACHE_CONTROL = {
+	'index': {'public': True, 'no_cache': True},
+	'category': {'public': True, 'no_cache': True},
+	'image': {'public': True, 'no_cache': True},
+	'thumbnail': {'public': True, 'max_age': 365 * 24 * 3600, 'immutable': True},
+	'thumbnail_unversioned': {'public': True, 'max_age': 3600},
+	'search': {'public': True, 'max_age': 60},
+	'api': {'public': True, 'no_cache': True},
+}
+
+# Number of images per page of an album, for albums not having their own page size
+CATEGORY_PAGE_SIZE = 100
+
+# Rendered pages of the index and albums are cached in this cache of CACHES, for PAGE_CACHE_TIMEOUT seconds
+# at most. Cached pages are invalidated on changes of the albums, images and formats shown. Use a cache shared
+# by all processes, like memcached or the database, when running multiple processes, otherwise changes are
+# only seen by the process making them until the timeout. View counts on cached pages are not updated until
+# the timeout. Set PAGE_CACHE_TIMEOUT to 0 to disable.
+PAGE_CACHE = 'default'
+
+PAGE_CACHE_TIMEOUT = 300
+
+# Implementation of search.Backend, the full-text index of the titles and descriptions of albums and images.
+# If None, an SQLite FTS5 table is used on SQLite, otherwise the tables are searched without an index.
+SEARCH_BACKEND = None
+
+# Maximum number of results of a search, and the number of results per page
+SEARCH_MAX_RESULTS = 500
+
+SEARCH_PAGE_SIZE = 20
+
+# Views are counted in memory, and written to the database every VIEWS_FLUSH_INTERVAL seconds, or as soon as
+# VIEWS_MAX_PENDING views are counted. Views counted since the last write are lost if the process is killed,
+# they are written on a graceful shutdown. Set VIEWS_FLUSH_INTERVAL to 0 to write every view at once.
+VIEWS_FLUSH_INTERVAL = 10
+
+VIEWS_MAX_PENDING = 1000
+
+# Number of threads per process creating thumbnails of images added in the admin in the background,
+# when the job queue is not enabled
+PRERENDER_THREADS = 2
+
+# Process images in the background by the job queue, run by `manage.py run_jobs': reading the size of
+# uploaded images, creating their thumbnails, creating thumbnails after a change of formats, and removing
+# files of deleted images. If not enabled, sizes are read and files removed in the request.
+JOBS_ENABLED = False
+
+# Seconds a job may take, before it is aborted
+JOBS_TIMEOUT = 300
+
+# Number of times a job is executed before it's given up (dead)
+JOBS_MAX_ATTEMPTS = 3
+
+# Seconds before the first retry of a failed job, doubled for every next retry
+JOBS_RETRY_DELAY = 30
+
+# Seconds to keep jobs that are done
+JOBS_KEEP_DONE = 7 * 24 * 3600
+
 MEDIA_URL = '/uploads/'
 
 FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
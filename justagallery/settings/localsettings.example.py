@@ -11,10 +11,18 @@ ALLOWED_HOSTS.append('gallery.example.com')
 
 MEDIA_ROOT = Path('/mnt/storage/justagallery-uploads')
 
+UPLOADS_STAGING_ROOT = Path('/mnt/storage/justagallery-staging')
+
 THUMBNAILS_ROOT = Path(os.environ['HOME']) / Path('.cache/justagallery-thumbnails')
 if not os.path.exists(THUMBNAILS_ROOT):
 	os.makedirs(THUMBNAILS_ROOT)
 
+# Faster thumbnails using libvips, needs pyvips and libvips installed (like `apt install libvips42')
+#IMAGE_BACKEND = 'justagallery.domain._vips.Image'
+
+# See nginx.example.conf
+THUMBNAILS_SENDFILE = 'X-Accel-Redirect'
+
 DATABASES['default'] = {
 	'ENGINE': 'django.db.backends.postgresql',
 	'NAME': 'justagallery',
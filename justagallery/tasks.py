@@ -0,0 +1,42 @@
+"""
+	Handlers of background jobs, see jobs.py.
+"""
+import os
+
+from . import models
+from .domain.image import get_size
+from .jobs import handler
+from .thumbnails import create_missing_thumbnails, get_images, remove_thumbnails
+
+
+@handler
+def process_image(image_id: int) -> None:
+	""" Retrieve the size of a new image, if not known yet, and create its thumbnails. """
+	try:
+		image = models.Image.objects.select_related('category').get(pk=image_id)
+	except models.Image.DoesNotExist:
+		return  # deleted meanwhile
+	if not image.width or not image.height:
+		image.width, image.height = get_size(image.file.path)
+		models.Image.objects.filter(pk=image.pk).update(width=image.width, height=image.height)
+	create_missing_thumbnails(image)
+
+
+@handler
+def render_thumbnails(path: str) -> None:
+	""" Create the missing thumbnails of the category with the path and the categories below it. """
+	for image in get_images([path]):
+		create_missing_thumbnails(image)
+
+
+@handler
+def delete_file(path: str) -> None:
+	try:
+		os.unlink(path)
+	except FileNotFoundError:
+		pass  # already removed by a previous attempt
+
+
+@handler
+def delete_thumbnails(category_id: int, slug: str) -> None:
+	remove_thumbnails(category_id, slug)
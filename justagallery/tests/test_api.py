@@ -0,0 +1,98 @@
+import shutil
+import tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+
+from .. import models
+
+
+class CategoryApiTest(TestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.media_root = tempfile.mkdtemp()
+		# images are not measured without the job queue running, and not processed
+		cls.settings = override_settings(MEDIA_ROOT=cls.media_root, JOBS_ENABLED=True, VIEWS_FLUSH_INTERVAL=0)
+		cls.settings.enable()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.settings.disable()
+		shutil.rmtree(cls.media_root)
+		super().tearDownClass()
+
+	def setUp(self):
+		thumbnail_format = models.ThumbnailFormat.objects.create(width=200, height=200, crop=True)
+		self.album = self._create_category('album', None, default_thumbnail_format=thumbnail_format, page_size=2)
+		self._create_category('sub', self.album)
+		self.images = [self._create_image(self.album, 'image-{}.jpg'.format(i)) for i in range(5)]
+		self.client = Client()
+
+	def test_cursors(self):
+		""" The next urls go through all images once, the previous urls back, to the first page without cursor """
+		urls = ['/api/categories/album']
+		pages = []
+		while urls[-1]:
+			response = self.client.get(urls[-1])
+			self.assertEqual(response.status_code, 200)
+			pages.append(response.json())
+			urls.append(pages[-1]['next'])
+		self.assertEqual([image['id'] for page in pages for image in page['images']],
+			[image.id for image in self.images])
+		self.assertEqual([len(page['children']) for page in pages], [1, 0, 0])
+		self.assertIsNone(pages[0]['previous'])
+		self.assertEqual(self.client.get(pages[2]['previous']).json()['images'], pages[1]['images'])
+		self.assertEqual(pages[1]['previous'], '/api/categories/album')
+
+	def test_invalid_cursors(self):
+		self.assertEqual(self.client.get('/api/categories/album?after=x').status_code, 400)
+		self.assertEqual(self.client.get('/api/categories/album?after=1.1&before=2.2').status_code, 400)
+		self.assertEqual(self.client.get('/api/categories/album?after=99999.99999').status_code, 404)
+
+	def test_fields(self):
+		""" The fields of albums and images are selected separately, and kept in the next url """
+		data = self.client.get('/api/categories/album?image_fields=id,thumbnails').json()
+		self.assertEqual(data['category']['url'], '/album/')
+		self.assertEqual(set(data['images'][0]), {'id', 'thumbnails'})
+		self.assertIn('image_fields=id%2Cthumbnails', data['next'])
+
+		data = self.client.get('/api/categories/album?category_fields=id,title').json()
+		self.assertEqual(data['category'], dict(id=self.album.id, title='album'))
+		self.assertEqual(set(data['children'][0]), {'id', 'title'})
+		self.assertIn('url', data['images'][0])
+
+		response = self.client.get('/api/categories/album?category_fields=thumbnails')
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(response.json()['error'], 'Unknown category_fields: thumbnails')
+		response = self.client.get('/api/images/album/{}?image_fields=path'.format(self.images[0].slug))
+		self.assertEqual(response.status_code, 400)
+
+	def test_not_modified(self):
+		""" The ETag is valid until the album changes """
+		response = self.client.get('/api/categories/album')
+		etag = response['ETag']
+		self.assertEqual(self.client.get('/api/categories/album', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		self.album.title = 'Album'
+		self.album.save()
+		response = self.client.get('/api/categories/album', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+
+	def test_children_of_hidden_album(self):
+		""" Sub-albums of a hidden album are listed like by its page, hidden ones not """
+		self.album.hidden = True
+		self.album.save()
+		self._create_category('hidden-sub', self.album, hidden=True)
+		self.assertContains(self.client.get('/album/'), '/album/sub/')
+		self.assertEqual([child['path'] for child in self.client.get('/api/categories/album').json()['children']],
+			['album/sub'])
+		self.assertEqual(self.client.get('/api/categories').json(), dict(categories=[]))
+
+	def _create_category(self, slug: str, parent: models.Category, **kwargs) -> models.Category:
+		return models.Category.objects.create(title=slug, slug=slug, parent=parent, description='', **kwargs)
+
+	def _create_image(self, category: models.Category, filename: str) -> models.Image:
+		image = models.Image(category=category, file=SimpleUploadedFile(filename, b'not decoded'))
+		image.save()
+		return image
@@ -0,0 +1,71 @@
+import io
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import PIL.Image
+from django.core.files import File
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from .. import models
+from ..thumbnails import create_missing_thumbnails, get_thumbnail_file
+
+
+class ReencodeThumbnailsTest(TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		# images measured at once, thumbnails in JPEG only
+		self.settings = override_settings(MEDIA_ROOT=self.directory + '/uploads',
+			THUMBNAILS_ROOT=Path(self.directory) / 'thumbnails', JOBS_ENABLED=False, THUMBNAILS_ENCODINGS=[])
+		self.settings.enable()
+		self.thumbnail_format = models.ThumbnailFormat.objects.create(width=200, height=200, crop=False, quality=95)
+		category = models.Category.objects.create(title='album', slug='album', description='',
+			default_thumbnail_format=self.thumbnail_format)
+		original = os.path.join(self.directory, 'original.jpg')
+		PIL.Image.effect_noise((600, 400), 64).convert('RGB').save(original, 'JPEG', quality=95)
+		with open(original, 'rb') as f:
+			self.image = models.Image(category=category, file=File(f, 'image.jpg'))
+			self.image.save()
+		create_missing_thumbnails(self.image)  # in the format, and in the size of the original without display formats
+		self.thumbnail = get_thumbnail_file(self.image, self.thumbnail_format, 'jpeg')
+
+	def tearDown(self):
+		self.settings.disable()
+		shutil.rmtree(self.directory)
+
+	def test_reencode(self):
+		""" Existing thumbnails are created again with the current options of their format """
+		size = self.thumbnail.stat().st_size
+		self.thumbnail_format.quality = 30
+		self.thumbnail_format.progressive = True
+		self.thumbnail_format.save()
+
+		output = self._call('--jobs', '1')
+
+		self.assertIn('Re-encoded 2 thumbnails', output)
+		self.assertLess(self.thumbnail.stat().st_size, size)
+		with PIL.Image.open(self.thumbnail) as im:
+			self.assertTrue(im.info.get('progressive'))
+
+	def test_dry_run(self):
+		""" Only reports the bytes that would be saved, leaving the thumbnails """
+		before = self.thumbnail.read_bytes()
+		self.thumbnail_format.quality = 30
+		self.thumbnail_format.save()
+
+		output = self._call('--jobs', '1', '--dry-run')
+
+		self.assertIn('Would re-encode 2 thumbnails', output)
+		self.assertIn('saving', output)
+		self.assertEqual(self.thumbnail.read_bytes(), before)
+
+	def test_other_album(self):
+		models.Category.objects.create(title='other', slug='other', description='')
+		self.assertIn('No thumbnails to re-encode', self._call('other'))
+
+	def _call(self, *args: str) -> str:
+		stdout = io.StringIO()
+		call_command('reencode_thumbnails', *args, stdout=stdout, stderr=io.StringIO())
+		return stdout.getvalue()
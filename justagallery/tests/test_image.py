@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Type
+
+import PIL.Image
+import PIL.ImageStat
+import PIL.JpegImagePlugin
+
+from .. import models
+from ..domain import image, _pil
+from ..thumbnails import get_encoder_options
+
+try:
+	from ..domain import _vips
+except ImportError:  # pyvips or libvips not installed
+	_vips = None
+
+# first bytes of the files of the encodings, the offset of the brand of AVIF being 4
+_SIGNATURES = {'jpeg': (0, b'\xff\xd8\xff'), 'webp': (8, b'WEBP'), 'avif': (4, b'ftypavif')}
+
+
+class ImageConformanceMixin:
+	""" Behaviour every implementation of domain.image.Image has, tested for each of them by the subclasses """
+	implementation: Type[image.Image]
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_get_size(self):
+		orig = self._create_original((300, 200))
+		self.assertEqual(self.implementation.get_size(orig), image.Size(300, 200))
+
+	def test_thumbnail_size(self):
+		""" Thumbnails fit in the size of the format, and are not enlarged """
+		for orig_size, size in (((800, 600), (200, 200)), ((600, 800), (200, 200)), ((1000, 333), (640, 480)),
+				((100, 50), (200, 200))):
+			with self.subTest(orig_size=orig_size, size=size):
+				thumbnail = self._create_thumbnail(self._create_original(orig_size), image.Size(*size), False)
+				expected = image.get_thumbnail_size(image.Size(*orig_size), image.Size(*size), False)
+				with PIL.Image.open(thumbnail) as im:
+					# implementations may round a pixel differently
+					self.assertAlmostEqual(im.width, expected.x, delta=1)
+					self.assertAlmostEqual(im.height, expected.y, delta=1)
+					self.assertLessEqual(im.width, size[0])
+					self.assertLessEqual(im.height, size[1])
+
+	def test_crop(self):
+		""" Cropped thumbnails are of the max square in the center, as _pil.Image._crop_max_square takes it """
+		for orig_size, size, expected in (((300, 100), (50, 50), (50, 50)), ((100, 300), (80, 60), (60, 60)),
+				((100, 60), (200, 200), (60, 60))):
+			with self.subTest(orig_size=orig_size, size=size):
+				orig = self._create_original(orig_size)
+				thumbnail = self._create_thumbnail(orig, image.Size(*size), True)
+				with PIL.Image.open(orig) as im, PIL.Image.open(thumbnail) as thumb:
+					self.assertEqual(thumb.size, expected)
+					square = _pil.Image._crop_max_square(im).resize(thumb.size)
+					for mean, expected_mean in zip(PIL.ImageStat.Stat(thumb.convert('RGB')).mean,
+							PIL.ImageStat.Stat(square).mean):
+						self.assertAlmostEqual(mean, expected_mean, delta=8)
+
+	def test_encodings(self):
+		for encoding in ('jpeg', *self.implementation.get_encodings()):
+			with self.subTest(encoding=encoding):
+				thumbnail = self._create_thumbnail(self._create_original((400, 300)), image.Size(100, 100), False,
+					encoding)
+				offset, signature = _SIGNATURES[encoding]
+				with open(thumbnail, 'rb') as file:
+					self.assertEqual(file.read(offset + len(signature))[offset:], signature)
+
+	def test_encoder_options(self):
+		thumbnail = self._create_thumbnail(self._create_original((400, 300)), image.Size(100, 100), False,
+			options=image.EncoderOptions(quality=50, progressive=True))
+		with PIL.Image.open(thumbnail) as im:
+			self.assertEqual(im.format, 'JPEG')
+			self.assertTrue(im.info.get('progressive'))
+
+	def test_encoder_options_of_format(self):
+		""" The encoder options of a thumbnail format, as passed by the thumbnails module, are applied """
+		orig = self._create_original((400, 300))
+		tables = {}
+		for quality in (30, 95):
+			thumbnail_format = models.ThumbnailFormat(width=100, height=100, crop=False, quality=quality,
+				progressive=True, subsampling='4:4:4')
+			thumbnail = self._create_thumbnail(orig, image.Size(100, 100), False,
+				options=get_encoder_options(thumbnail_format))
+			with PIL.Image.open(thumbnail) as im:
+				self.assertTrue(im.info.get('progressive'))
+				self.assertEqual(PIL.JpegImagePlugin.get_sampling(im), 0)  # 4:4:4
+				tables[quality] = sum(im.quantization[0])
+		# coarser quantization at the lower quality
+		self.assertGreater(tables[30], tables[95])
+
+	def _create_original(self, size) -> str:
+		""" JPEG with a red square in the center, and blue to the sides """
+		im = PIL.Image.new('RGB', size, (0, 0, 255))
+		side = min(size)
+		left, upper = (size[0] - side) // 2, (size[1] - side) // 2
+		im.paste((255, 0, 0), (left, upper, left + side, upper + side))
+		path = os.path.join(self.directory, '{}x{}.jpg'.format(*size))
+		im.save(path, 'JPEG', quality=95)
+		return path
+
+	def _create_thumbnail(self, orig: str, size: image.Size, crop: bool, encoding: str = 'jpeg',
+			options: image.EncoderOptions = image.EncoderOptions()) -> str:
+		dest = os.path.join(self.directory, 'thumbnails', '{}x{}{}.{}'.format(*size, '-c' if crop else '', encoding))
+		self.implementation.create_thumbnail(orig, dest, size, crop, encoding, options)
+		return dest
+
+
+class PilImageTest(ImageConformanceMixin, unittest.TestCase):
+	implementation = _pil.Image
+
+
+@unittest.skipUnless(_vips, 'pyvips is not installed')
+class VipsImageTest(ImageConformanceMixin, unittest.TestCase):
+	implementation = _vips.Image if _vips else None
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import PIL.Image
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from .. import models
+
+
+class CategorySaveTest(TestCase):
+	def test_stale_instance_keeps_effective_settings(self):
+		""" Saving a category loaded before a parent became private or hidden keeps it private and hidden """
+		owner = User.objects.create(username='owner')
+		thumbnail_format = models.ThumbnailFormat.objects.create(width=200, height=200, crop=True)
+		parent = self._create_category('parent', None, owner=owner)
+		self._create_category('child', parent)
+		stale = models.Category.objects.get(slug='child')
+
+		parent.private = parent.hidden = True
+		parent.default_thumbnail_format = thumbnail_format
+		parent.save()
+		stale.title = 'Renamed'
+		stale.save()
+
+		child = models.Category.objects.get(slug='child')
+		self.assertEqual(child.title, 'Renamed')
+		self.assertEqual(child.private_owner_id, owner.id)
+		self.assertTrue(child.effective_hidden)
+		self.assertEqual(child.effective_thumbnail_format_id, thumbnail_format.id)
+
+	def _create_category(self, slug: str, parent: models.Category, **kwargs) -> models.Category:
+		return models.Category.objects.create(title=slug, slug=slug, parent=parent, description='', **kwargs)
+
+
+class ImageDeleteTest(TestCase):
+	def setUp(self):
+		self.media_root = tempfile.mkdtemp()
+		# jobs executed at once, instead of queued
+		self.settings = override_settings(MEDIA_ROOT=self.media_root, THUMBNAILS_ROOT=Path(self.media_root) / 'thumbnails',
+			JOBS_ENABLED=False)
+		self.settings.enable()
+		category = models.Category.objects.create(title='album', slug='album', description='')
+		original = os.path.join(self.media_root, 'original.jpg')
+		PIL.Image.new('RGB', (30, 20)).save(original, 'JPEG')
+		with open(original, 'rb') as f:
+			self.image = models.Image(category=category, file=File(f, 'image.jpg'))
+			self.image.save()
+
+	def tearDown(self):
+		self.settings.disable()
+		shutil.rmtree(self.media_root)
+
+	def test_file_kept_on_rollback(self):
+		""" The file of the image is only deleted, without the job queue, once the deletion is committed """
+		image_id = self.image.pk
+		with self.assertRaises(RuntimeError), transaction.atomic():
+			self.image.delete()
+			raise RuntimeError('rolled back')
+		self.assertTrue(models.Image.objects.filter(pk=image_id).exists())
+		self.assertTrue(os.path.exists(self.image.file.path))
+
+	def test_file_deleted_on_commit(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.image.delete()
+		self.assertFalse(os.path.exists(self.image.file.path))
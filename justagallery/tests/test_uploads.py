@@ -0,0 +1,46 @@
+import io
+import shutil
+import tempfile
+
+import PIL.Image
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from .. import models
+from ..uploads import finalize_upload, receive_chunk, start_upload
+
+
+class ChunkedUploadTest(TestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.media_root = tempfile.mkdtemp()
+		cls.settings = override_settings(MEDIA_ROOT=cls.media_root, UPLOADS_STAGING_ROOT=cls.media_root + '/staging',
+			JOBS_ENABLED=False)
+		cls.settings.enable()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.settings.disable()
+		shutil.rmtree(cls.media_root)
+		super().tearDownClass()
+
+	def test_finalize_counts_filesize(self):
+		""" The image of a chunked upload has the size of its file, added to the bytes of its album """
+		owner = User.objects.create(username='owner', is_staff=True)
+		category = models.Category.objects.create(title='album', slug='album', description='')
+		data = self._create_jpeg()
+		upload = start_upload(category, owner, 'upload.jpg', len(data))
+		receive_chunk(upload, 0, [data[:1000]])
+		receive_chunk(upload, 1000, [data[1000:]])
+
+		image, _ = finalize_upload(upload)
+
+		self.assertEqual(image.filesize, len(data))
+		self.assertEqual(models.Image.objects.get(pk=image.pk).filesize, len(data))
+		self.assertEqual(models.Category.objects.get(pk=category.pk).total_bytes, len(data))
+
+	def _create_jpeg(self) -> bytes:
+		f = io.BytesIO()
+		PIL.Image.effect_noise((300, 200), 64).save(f, 'JPEG', quality=95)
+		return f.getvalue()
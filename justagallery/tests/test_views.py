@@ -0,0 +1,119 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import PIL.Image
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .. import models
+from ..domain.url import get_thumbnail_url, get_url_by_category
+from ..thumbnails import invalidate_category_thumbnails
+
+
+class CategoryViewTest(TestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.media_root = tempfile.mkdtemp()
+		# images are not measured without the job queue running, and not processed. Views are written at once,
+		# not buffered until after the test database is gone.
+		cls.settings = override_settings(MEDIA_ROOT=cls.media_root, JOBS_ENABLED=True, PAGE_CACHE_TIMEOUT=0,
+			VIEWS_FLUSH_INTERVAL=0)
+		cls.settings.enable()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.settings.disable()
+		shutil.rmtree(cls.media_root)
+		super().tearDownClass()
+
+	def test_queries_independent_of_number_of_children(self):
+		""" The album page takes the same number of queries for 3 and for 30 sub-albums with cover images """
+		thumbnail_format = models.ThumbnailFormat.objects.create(width=200, height=200, crop=True)
+		self._assert_same_queries(self._create_album('few', 3, 5, thumbnail_format), 3 + 5,
+			self._create_album('many', 30, 5, thumbnail_format), 30 + 5)
+
+	def test_queries_independent_of_number_of_images(self):
+		""" The album page takes the same number of queries for 3 and for 40 images, some with formats of their own """
+		thumbnail_format = models.ThumbnailFormat.objects.create(width=200, height=200, crop=True)
+		display_format = models.ThumbnailFormat.objects.create(width=800, height=600, crop=False)
+		few = self._create_album('few', 2, 3, thumbnail_format, display_format)
+		many = self._create_album('many', 2, 40, thumbnail_format, display_format)
+		self._assert_same_queries(few, 2 + 3, many, 2 + 40)
+
+	def _assert_same_queries(self, few: str, few_thumbnails: int, many: str, many_thumbnails: int):
+		# a new session for every album, so counting the view takes the same queries
+		with CaptureQueriesContext(connection) as queries:
+			response = Client().get(few)
+		self.assertEqual(response.content.count(b'/thumbnails/'), few_thumbnails)
+		with self.assertNumQueries(len(queries)):
+			response = Client().get(many)
+		self.assertEqual(response.content.count(b'/thumbnails/'), many_thumbnails)
+
+	def _create_album(self, slug: str, children: int, images: int, thumbnail_format: models.ThumbnailFormat,
+			display_format: models.ThumbnailFormat = None) -> str:
+		"""
+			Album with sub-albums having a cover image, and images of its own, every other one having
+			the display format if given. :return: its url
+		"""
+		category = self._create_category(slug, None, default_thumbnail_format=thumbnail_format)
+		for i in range(children):
+			child = self._create_category('{}-{}'.format(slug, i), category)
+			self._create_image(child, 'cover.jpg')
+		for i in range(images):
+			image = self._create_image(category, 'image-{}.jpg'.format(i))
+			if display_format and i % 2:
+				image.display_formats.add(display_format)
+		return get_url_by_category(category)
+
+	def _create_category(self, slug: str, parent: models.Category, **kwargs) -> models.Category:
+		return models.Category.objects.create(title=slug, slug=slug, parent=parent, description='', **kwargs)
+
+	def _create_image(self, category: models.Category, filename: str) -> models.Image:
+		image = models.Image(category=category, file=SimpleUploadedFile(filename, b'not decoded'))
+		image.save()
+		return image
+
+
+class ThumbnailViewTest(TestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.directory = tempfile.mkdtemp()
+		# images measured at once, thumbnails rendered by the view itself, sent in JPEG only
+		cls.settings = override_settings(MEDIA_ROOT=cls.directory + '/uploads',
+			THUMBNAILS_ROOT=Path(cls.directory) / 'thumbnails', JOBS_ENABLED=False, THUMBNAILS_ENCODINGS=[],
+			THUMBNAILS_SENDFILE=None)
+		cls.settings.enable()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.settings.disable()
+		shutil.rmtree(cls.directory)
+		super().tearDownClass()
+
+	def test_existing_thumbnail_without_queries(self):
+		""" Existing thumbnails are sent without queries, immutable only at the current version of the image """
+		thumbnail_format = models.ThumbnailFormat.objects.create(width=100, height=100, crop=True)
+		category = models.Category.objects.create(title='album', slug='album', description='',
+			default_thumbnail_format=thumbnail_format)
+		original = self.directory + '/image.jpg'
+		PIL.Image.new('RGB', (300, 200)).save(original, 'JPEG')
+		with open(original, 'rb') as f:
+			image = models.Image(category=category, file=File(f, 'image.jpg'))
+			image.save()
+		invalidate_category_thumbnails()  # on commit, never reached in a test case
+		url = get_thumbnail_url(image, thumbnail_format)
+		self.assertEqual(Client().get(url).status_code, 200)  # rendered, and the tables of the category loaded
+
+		with self.assertNumQueries(0):
+			response = Client().get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('immutable', response['Cache-Control'])
+		with self.assertNumQueries(0):
+			response = Client().get(url.partition('?')[0] + '?v=1')
+		self.assertNotIn('immutable', response['Cache-Control'])
@@ -0,0 +1,305 @@
+"""
+	Thumbnails of images as stored on disk, in the THUMBNAILS_ROOT directory.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import models
+from .domain import entities
+from .domain.category import get_thumbnail_formats
+from .domain.image import ENCODINGS, EncoderOptions, Size, Thumbnail, create_thumbnails, \
+	get_encodings as get_supported_encodings
+from .domain.url import get_thumbnail_path, get_thumbnail_version
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class _Categories:
+	""" Ids of all categories, and of the private ones """
+	ids: FrozenSet[int]
+	private_ids: FrozenSet[int]
+
+
+@dataclass(frozen=True)
+class _CategoryThumbnails:
+	""" What thumbnails of the images in a category can exist """
+	formats: FrozenSet[Tuple[int, int, bool]]  # of the category and its images
+	widths: FrozenSet[int]  # of the originals
+	heights: FrozenSet[int]
+	versions: Dict[str, str]  # of the thumbnails of the images by slug, as in their urls
+
+
+# Cached in memory: the categories, the thumbnails of existing categories by id, and thumbnails known to be
+# missing with the time they expire, all cleared when the mtime of the generation file changes, on any change of
+# categories, formats or images in any process.
+_categories: Optional[_Categories] = None
+_category_thumbnails: Dict[int, _CategoryThumbnails] = {}
+_missing: 'OrderedDict[str, float]' = OrderedDict()
+_generation: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_encodings() -> List[str]:
+	""" Encodings thumbnails are created in: JPEG, and the THUMBNAILS_ENCODINGS supported by the implementation. """
+	supported = get_supported_encodings()
+	return ['jpeg'] + [encoding for encoding in settings.THUMBNAILS_ENCODINGS if encoding in supported]
+
+
+def get_thumbnail_file(image: entities.Image, thumbnail_format: entities.ThumbnailFormat,
+		encoding: str = 'jpeg') -> Path:
+	""" Location of the thumbnail on disk. Encodings other than JPEG are stored next to it, with their suffix. """
+	return settings.THUMBNAILS_ROOT / get_encoded_path(get_thumbnail_path(image, thumbnail_format), encoding)
+
+
+def get_encoded_path(path: str, encoding: str) -> str:
+	""" Path of the thumbnail with the path in the encoding """
+	return path if encoding == 'jpeg' else '{}.{}'.format(path, encoding)
+
+
+def get_missing_thumbnails(image: entities.Image) -> List[Tuple[entities.ThumbnailFormat, str, Path]]:
+	"""
+		All thumbnails of the image, in any of the formats it is shown in and every encoding,
+		that do not exist on disk yet, with their encoding and location.
+	"""
+	return _get_missing_thumbnails(image, get_thumbnail_formats(image))
+
+
+def get_thumbnails(formats: Iterable[Tuple[entities.ThumbnailFormat, str, Path]]) -> List[Thumbnail]:
+	""" Thumbnails to create for the formats, encodings and locations, as returned by get_missing_thumbnails """
+	return [Thumbnail(str(path), Size(thumbnail_format.width, thumbnail_format.height), thumbnail_format.crop, encoding,
+			get_encoder_options(thumbnail_format))
+		for thumbnail_format, encoding, path in formats]
+
+
+def get_encoder_options(thumbnail_format: entities.ThumbnailFormat) -> EncoderOptions:
+	return EncoderOptions(
+		quality=thumbnail_format.quality or None,
+		progressive=thumbnail_format.progressive,
+		optimize=thumbnail_format.optimize,
+		subsampling=thumbnail_format.subsampling or None,
+		strip_metadata=thumbnail_format.strip_metadata,
+	)
+
+
+def create_missing_thumbnails(image: models.Image, *thumbnail_formats: entities.ThumbnailFormat) -> None:
+	"""
+		Create all missing thumbnails of the image, in the given formats (that don't need to be
+		one of the formats of the image) and all formats the image is shown in, in every encoding,
+		decoding the image once.
+	"""
+	# formats of the image first, with their encoder options, for the given ones having the same size
+	formats = get_missing_thumbnails(image)
+	paths = {path for _, _, path in formats}
+	formats += [(thumbnail_format, encoding, path)
+		for thumbnail_format, encoding, path in _get_missing_thumbnails(image, thumbnail_formats) if path not in paths]
+	if formats:
+		create_thumbnails(image.file.path, get_thumbnails(formats))
+
+
+def _get_missing_thumbnails(image: entities.Image, thumbnail_formats: Iterable[entities.ThumbnailFormat]) \
+		-> List[Tuple[entities.ThumbnailFormat, str, Path]]:
+	encodings = get_encodings()
+	return [(thumbnail_format, encoding, path) for thumbnail_format in thumbnail_formats for encoding in encodings
+		if not (path := get_thumbnail_file(image, thumbnail_format, encoding)).exists()]
+
+
+def get_images(category_paths: Iterable[str] = ()) -> Iterator[models.Image]:
+	"""
+		Iterate over all images, or only the images in the categories with given paths and
+		the categories below, one category at a time, with the formats needed to find their thumbnails.
+	"""
+	categories = models.Category.objects.order_by('path')
+	if category_paths:
+		q = Q()
+		for path in category_paths:
+			q |= Q(path=path) | Q(path__below=path)
+		categories = categories.filter(q)
+	for category in categories:
+		prefetch_related_objects([category], 'effective_display_formats', 'effective_thumbnail_formats')
+		yield from category.images.prefetch_related('display_formats')
+
+
+def remove_thumbnails(category_id: int, slug: str) -> None:
+	""" Remove the thumbnails in all sizes of the image with the slug, in the category with the id. """
+	category_dir = Path(settings.THUMBNAILS_ROOT) / str(category_id)
+	try:
+		size_dirs = list(category_dir.iterdir())
+	except FileNotFoundError:
+		return
+	for size_dir in size_dirs:
+		for encoding in ('jpeg',) + ENCODINGS:
+			path = size_dir / get_encoded_path(slug, encoding)
+			try:
+				path.unlink()
+				logger.debug('Removed thumbnail {}'.format(path))
+			except (FileNotFoundError, NotADirectoryError):
+				pass
+
+
+def get_orphaned_thumbnails() -> Iterator[Path]:
+	"""
+		Iterate over the thumbnails on disk that are not of an existing image, in one of the formats
+		it is shown in and one of the encodings in use. Hidden files, being locks and thumbnails being
+		written, are skipped.
+		Thumbnails of images added while iterating can be reported too, which are recreated when requested.
+	"""
+	categories = {str(category.id): category for category in models.Category.objects.all()}
+	encodings = get_encodings()
+	for category_dir in sorted(Path(settings.THUMBNAILS_ROOT).iterdir()):
+		if not category_dir.is_dir() or category_dir.name.startswith('.'):
+			continue
+		expected: Set[Path] = set()
+		if category := categories.get(category_dir.name):
+			prefetch_related_objects([category], 'effective_display_formats', 'effective_thumbnail_formats')
+			for image in category.images.prefetch_related('display_formats'):
+				expected.update(get_thumbnail_file(image, thumbnail_format, encoding)
+					for thumbnail_format in get_thumbnail_formats(image) for encoding in encodings)
+		for path in iter_thumbnail_files(category_dir):
+			if path not in expected:
+				yield path
+
+
+def iter_thumbnail_files(directory: Path = None) -> Iterator[Path]:
+	""" Iterate over all thumbnail files in the directory of a category, or in all categories if not given. """
+	if directory is None:
+		for category_dir in Path(settings.THUMBNAILS_ROOT).iterdir():
+			if category_dir.is_dir() and not category_dir.name.startswith('.'):
+				yield from iter_thumbnail_files(category_dir)
+		return
+	for size_dir in directory.iterdir():
+		if size_dir.is_dir() and not size_dir.name.startswith('.'):
+			for path in size_dir.iterdir():
+				if not path.name.startswith('.') and path.is_file():
+					yield path
+
+
+def is_allowed_size(category_id: int, x: int, y: int, crop: bool) -> bool:
+	"""
+		Whether thumbnails of the size can exist in the category, in one of the formats of the category or its
+		images, or possibly in the size of an original. Needs no queries, after the first time for the category.
+		Categories that don't exist are rejected without queries, after the first time for any category.
+	"""
+	if category_id not in _get_categories().ids:
+		return False
+	thumbnails = _get_category_thumbnails(category_id)
+	return (x, y, crop) in thumbnails.formats or (not crop and (x in thumbnails.widths or y in thumbnails.heights))
+
+
+def is_current_version(category_id: int, slug: str, version: str) -> bool:
+	""" Whether the version is the one of the current thumbnails of the image. Needs no queries, like is_allowed_size. """
+	if category_id not in _get_categories().ids:
+		return False
+	return _get_category_thumbnails(category_id).versions.get(slug) == version
+
+
+def is_private_category(category_id: int) -> bool:
+	return category_id in _get_categories().private_ids
+
+
+def is_known_missing(path: str) -> bool:
+	""" Whether the thumbnail with the path (relative to THUMBNAILS_ROOT) was found not to exist recently. """
+	_check_generation()
+	expires = _missing.get(path)
+	if expires is None:
+		return False
+	if expires < time.monotonic():
+		with _lock:
+			_missing.pop(path, None)
+		return False
+	return True
+
+
+def remember_missing(path: str) -> None:
+	""" Remember that the thumbnail with the path can't exist, for THUMBNAILS_MISSING_TTL seconds. """
+	with _lock:
+		_missing[path] = time.monotonic() + settings.THUMBNAILS_MISSING_TTL
+		_missing.move_to_end(path)
+		while len(_missing) > settings.THUMBNAILS_MISSING_MAX:
+			_missing.popitem(last=False)
+
+
+def invalidate_category_thumbnails() -> None:
+	""" Clear cached allowed sizes and missing thumbnails, in all processes. """
+	generation_file = Path(settings.THUMBNAILS_ROOT) / '.generation'
+	os.makedirs(generation_file.parent, exist_ok=True)
+	generation_file.touch()
+	now = time.time_ns()
+	os.utime(generation_file, ns=(now, now))
+	_check_generation()
+
+
+def _get_categories() -> _Categories:
+	global _categories
+	_check_generation()
+	categories = _categories
+	if categories is None:
+		rows = list(models.Category.objects.values_list('id', 'private_owner_id'))
+		categories = _Categories(
+			ids=frozenset(category_id for category_id, _ in rows),
+			private_ids=frozenset(category_id for category_id, private_owner_id in rows if private_owner_id),
+		)
+		with _lock:
+			_categories = categories
+	return categories
+
+
+def _get_category_thumbnails(category_id: int) -> _CategoryThumbnails:
+	_check_generation()
+	thumbnails = _category_thumbnails.get(category_id)
+	if thumbnails is None:
+		sizes = ('thumbnailformat__width', 'thumbnailformat__height', 'thumbnailformat__crop')
+		formats = set(models.Category.effective_display_formats.through.objects
+			.filter(category_id=category_id).values_list(*sizes))
+		formats.update(models.Category.effective_thumbnail_formats.through.objects
+			.filter(category_id=category_id).values_list(*sizes))
+		formats.update(models.Image.display_formats.through.objects
+			.filter(image__category_id=category_id).values_list(*sizes))
+		images = list(models.Image.objects.filter(category_id=category_id).only('slug', 'width', 'height', 'updated_at'))
+		thumbnails = _CategoryThumbnails(
+			formats=frozenset(formats),
+			widths=frozenset(image.width for image in images if image.width),
+			heights=frozenset(image.height for image in images if image.height),
+			versions={image.slug: get_thumbnail_version(image) for image in images},
+		)
+		with _lock:
+			_category_thumbnails[category_id] = thumbnails
+	return thumbnails
+
+
+def _check_generation() -> None:
+	global _categories, _generation
+	try:
+		generation = (Path(settings.THUMBNAILS_ROOT) / '.generation').stat().st_mtime_ns
+	except FileNotFoundError:
+		generation = 0
+	if generation != _generation:
+		with _lock:
+			_categories = None
+			_category_thumbnails.clear()
+			_missing.clear()
+			_generation = generation
+
+
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+@receiver(post_save, sender=models.Image)
+@receiver(post_delete, sender=models.Image)
+@receiver(post_save, sender=models.ThumbnailFormat)
+@receiver(post_delete, sender=models.ThumbnailFormat)
+@receiver(m2m_changed, sender=models.Category.display_formats.through)
+@receiver(m2m_changed, sender=models.Image.display_formats.through)
+def _formats_or_images_changed(sender, **kwargs):
+	transaction.on_commit(invalidate_category_thumbnails)
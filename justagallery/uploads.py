@@ -0,0 +1,320 @@
+"""
+	Adding uploaded images in bulk, and uploading images in chunks.
+"""
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import DatabaseError, transaction
+from django.db.models import Max, prefetch_related_objects
+
+from . import jobs, models, pagecache, search
+from .domain import entities
+from .domain.image import Size, get_size
+from .thumbnails import create_missing_thumbnails
+
+try:
+	import fcntl
+except ImportError:  # not available on all platforms, chunks of an upload are not protected from concurrent writes then
+	fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_BATCH_SIZE = 100
+
+# sha256 state of uploads being received by this process, with the offset up to which they are hashed
+_MAX_HASHERS = 64
+_hashers: 'OrderedDict[uuid.UUID, Tuple[int, Any]]' = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+	pass
+
+
+class UploadConflict(UploadError):
+	""" Chunk doesn't start at the offset received so far, or another chunk is being received at the same time """
+
+_prerender_executor: Optional[ThreadPoolExecutor] = None
+
+
+@dataclass
+class AddedImages:
+	images: List[models.Image] = field(default_factory=list)
+	failures: List[Tuple[str, str]] = field(default_factory=list)  # file name and error
+
+
+def add_images(category: models.Category, uploads: Sequence[UploadedFile], owner: Optional[entities.User] = None,
+		prerender: bool = False) -> AddedImages:
+	"""
+		Add the uploaded images to the category, in the given order, after the images already in it.
+		Image headers are read in parallel, the sequences are calculated with one query, and the images
+		are inserted in batches. Files that fail are reported, and don't stop the others from being added.
+		:param prerender: also create the thumbnails of the images in the background
+	"""
+	result = AddedImages()
+	with ThreadPoolExecutor() as executor:
+		sizes = list(executor.map(_probe, uploads))
+
+	sequence = (category.images.aggregate(max_sequence=Max('sequence'))['max_sequence'] or 0) + 10
+	now = datetime.now()
+	images: List[models.Image] = []
+	for upload, size in zip(uploads, sizes):
+		if isinstance(size, Exception):
+			result.failures.append((upload.name, str(size)))
+			continue
+		image = models.Image(category=category, owner=owner, width=size.x, height=size.y, sequence=sequence,
+			created_at=now, updated_at=now)
+		try:
+			# store file now, to get the definitive unique file name, necessary for the slug
+			image.file.save(upload.name, upload, save=False)
+			image.filesize = image.file.size
+		except Exception as e:
+			result.failures.append((upload.name, str(e)))
+			continue
+		image.slug = os.path.basename(image.file.path)
+		image.title, _ = os.path.splitext(image.slug)
+		image.description = image.title
+		images.append(image)
+		sequence += 10
+
+	for i in range(0, len(images), _BATCH_SIZE):
+		batch = images[i:i + _BATCH_SIZE]
+		try:
+			with transaction.atomic():
+				models.Image.objects.bulk_create(batch)
+			result.images += batch
+		except DatabaseError as e:
+			logger.warning('Cannot insert batch of images, inserting them one by one: {}'.format(e))
+			for image in batch:
+				try:
+					with transaction.atomic():
+						models.Image.objects.bulk_create([image])
+					result.images.append(image)
+				except DatabaseError as e:
+					result.failures.append((image.slug, str(e)))
+					image.file.delete(save=False)
+
+	if result.images:
+		# the images are inserted in bulk, without save() and signals
+		models.add_statistics(category.id, len(result.images), sum(image.filesize for image in result.images))
+		models.save_covers([category.id])
+		pagecache.invalidate_categories([category.id])
+		search.index(category.images.filter(slug__in=[image.slug for image in result.images])
+			.only('id', 'title', 'description'))
+	if prerender and result.images:
+		prerender_thumbnails(category, result.images)
+	return result
+
+
+def prerender_thumbnails(category: models.Category, images: List[models.Image]) -> None:
+	"""
+		Create the thumbnails of the new images of the category in the background, by the job queue
+		if enabled, otherwise in this process.
+	"""
+	global _prerender_executor
+	if settings.JOBS_ENABLED:
+		# the images are inserted in bulk, without their ids
+		image_ids = category.images.filter(slug__in=[image.slug for image in images]).values_list('id', flat=True)
+		jobs.enqueue_many('process_image', [dict(image_id=image_id) for image_id in image_ids])
+		return
+	# the formats the images are shown in are resolved before, so the background threads don't need queries
+	prefetch_related_objects([category], 'effective_display_formats', 'effective_thumbnail_formats')
+	if _prerender_executor is None:
+		_prerender_executor = ThreadPoolExecutor(max_workers=settings.PRERENDER_THREADS,
+			thread_name_prefix='prerender')
+	for image in images:
+		image.category = category
+		_prerender_executor.submit(_prerender, image)
+
+
+def _prerender(image: models.Image) -> None:
+	try:
+		create_missing_thumbnails(image)
+	except Exception:
+		logger.exception('Cannot create thumbnails of {}'.format(image.file.path))
+
+
+def _probe(upload: UploadedFile) -> Union[Size, Exception]:
+	""" Size of the uploaded image, or the exception when it can't be read. """
+	try:
+		return get_size(upload.temporary_file_path())
+	except Exception as e:
+		return e
+
+
+def get_staging_file(upload: models.Upload) -> Path:
+	""" Location of the file being uploaded, in UPLOADS_STAGING_ROOT. """
+	return Path(settings.UPLOADS_STAGING_ROOT) / str(upload.id)
+
+
+def start_upload(category: models.Category, owner: entities.User, filename: str, size: int) -> models.Upload:
+	""" Start the upload of an image of `size' bytes into the category, to receive in chunks. """
+	if size < 1:
+		raise UploadError('Size should be greater than 0')
+	upload = models.Upload.objects.create(category=category, owner=owner, filename=os.path.basename(filename),
+		size=size)
+	path = get_staging_file(upload)
+	os.makedirs(path.parent, exist_ok=True)
+	path.touch()
+	return upload
+
+
+def receive_chunk(upload: models.Upload, offset: int, data: Iterable[bytes]) -> None:
+	"""
+		Append a chunk starting at `offset' to the upload, writing and hashing the data as it is received.
+		The size of the image is read as soon as its header is received. When receiving the chunk is
+		interrupted, the data received so far is kept, so the upload can resume from upload.offset.
+		:param data: blocks of data of the chunk
+		:raises UploadConflict if the chunk doesn't start at upload.offset
+		:raises UploadError if the chunk exceeds the size of the upload
+	"""
+	with _staging_file(upload) as f:
+		if offset != upload.offset:
+			raise UploadConflict('Expected chunk at offset {}'.format(upload.offset))
+		hasher = _get_hasher(upload, f)
+		f.seek(upload.offset)
+		f.truncate()  # remove any data written after the last recorded offset
+		try:
+			for block in data:
+				if upload.offset + len(block) > upload.size:
+					raise UploadError('Chunk exceeds the size of {} bytes'.format(upload.size))
+				f.write(block)
+				hasher.update(block)
+				upload.offset += len(block)
+		finally:
+			f.flush()
+			if not upload.width:
+				try:
+					upload.width, upload.height = get_size(f.name)
+				except Exception:
+					pass  # header not received yet
+			upload.updated_at = datetime.now()
+			upload.save(update_fields=['offset', 'width', 'height', 'updated_at'])
+			with _hashers_lock:
+				_hashers[upload.id] = (upload.offset, hasher)
+				while len(_hashers) > _MAX_HASHERS:
+					_hashers.popitem(last=False)
+
+
+def finalize_upload(upload: models.Upload, sha256: Optional[str] = None) -> Tuple[models.Image, str]:
+	"""
+		Create the image of the complete upload, moving the staged file in place.
+		:param sha256: hex digest of the file to verify, if given
+		:return: the image and the sha256 hex digest of its file
+		:raises UploadError if the upload is not complete or not an image, or the digest doesn't match
+	"""
+	with _staging_file(upload) as f:
+		if upload.offset != upload.size:
+			raise UploadError('Incomplete, received {} of {} bytes'.format(upload.offset, upload.size))
+		digest = _get_hasher(upload, f).hexdigest()
+		if sha256 and sha256.lower() != digest:
+			raise UploadError('SHA-256 digest mismatch, received file has {}'.format(digest))
+		if not upload.width:
+			raise UploadError('Cannot read the image size, not an image')
+		image = models.Image(category=upload.category, owner=upload.owner, width=upload.width, height=upload.height)
+		# store file now, to get the definitive unique file name, necessary for the slug
+		image.file.save(upload.filename, _StagedFile(f, upload.filename), save=False)
+		image.slug = os.path.basename(image.file.path)
+		try:
+			image.save()
+		except Exception:
+			image.file.delete(save=False)
+			raise
+		_discard(upload)
+	return image, digest
+
+
+def abort_upload(upload: models.Upload) -> None:
+	with _staging_file(upload) as f:
+		os.unlink(f.name)
+		_discard(upload)
+
+
+def expire_uploads(max_age: int) -> int:
+	"""
+		Remove the uploads that received no chunk for `max_age' seconds, and staged files without an
+		upload that are as old. Uploads receiving a chunk at the moment are left alone.
+		:return: number of uploads removed
+	"""
+	expired = datetime.now() - timedelta(seconds=max_age)
+	count = 0
+	for upload in models.Upload.objects.filter(updated_at__lt=expired):
+		if get_staging_file(upload).exists():
+			offset = upload.offset
+			try:
+				with _staging_file(upload) as f:
+					if upload.offset != offset:  # received a chunk meanwhile
+						continue
+					os.unlink(f.name)
+			except UploadConflict:  # receiving a chunk, or finished meanwhile
+				continue
+		_discard(upload)
+		count += 1
+	upload_ids = {str(upload_id) for upload_id in models.Upload.objects.values_list('id', flat=True)}
+	try:
+		paths = list(Path(settings.UPLOADS_STAGING_ROOT).iterdir())
+	except FileNotFoundError:
+		paths = []
+	for path in paths:
+		try:
+			if path.name not in upload_ids and datetime.fromtimestamp(path.stat().st_mtime) < expired:
+				path.unlink()
+		except FileNotFoundError:
+			pass
+	return count
+
+
+class _StagedFile(File):
+	""" Staged file, that the storage moves in place like a temporary uploaded file, instead of copying it """
+	def temporary_file_path(self) -> str:
+		return self.file.name
+
+
+@contextmanager
+def _staging_file(upload: models.Upload) -> Iterator[BinaryIO]:
+	""" Open the staging file of the upload, locked, and refresh the upload from the database. """
+	try:
+		f = open(get_staging_file(upload), 'r+b')
+	except FileNotFoundError:
+		raise UploadConflict('Upload is finished')
+	with f:
+		if fcntl:
+			try:
+				fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				raise UploadConflict('Another chunk is being received')
+		upload.refresh_from_db()
+		yield f
+
+
+def _get_hasher(upload: models.Upload, f: BinaryIO) -> Any:
+	""" sha256 state of the upload, hashing the received data again if it's not hashed by this process. """
+	with _hashers_lock:
+		offset, hasher = _hashers.pop(upload.id, (None, None))
+	if offset != upload.offset:
+		hasher = hashlib.sha256()
+		f.seek(0)
+		remaining = upload.offset
+		while remaining and (block := f.read(min(remaining, 1 << 20))):
+			hasher.update(block)
+			remaining -= len(block)
+	return hasher
+
+
+def _discard(upload: models.Upload) -> None:
+	with _hashers_lock:
+		_hashers.pop(upload.id, None)
+	upload.delete()
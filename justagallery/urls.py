@@ -17,11 +17,18 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, re_path
-from . import views
+from . import api, views
 
 urlpatterns = [
 	path('', views.index, name='index'),
 	path('admin/', admin.site.urls),
+	path('search', views.search, name='search'),
+	path('api/uploads', api.uploads, name='api-uploads'),
+	path('api/uploads/<uuid:upload_id>', api.upload, name='api-upload'),
+	path('api/uploads/<uuid:upload_id>/finalize', api.upload_finalize, name='api-upload-finalize'),
+	path('api/categories', api.categories, name='api-categories'),
+	path('api/categories/<path:path>', api.category, name='api-category'),
+	path('api/images/<path:path>', api.image, name='api-image'),
 	re_path(r'^(.*)/$', views.category, name='category'),
 	re_path(r'^(.*)/(.*).html$', views.image, name='image'),
 	re_path(r'^thumbnails/([0-9]+)/(.+)/(.+)$', views.thumbnail, name='thumbnail'),
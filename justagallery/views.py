@@ -1,21 +1,33 @@
+import hashlib
 import logging
+import os
 
+from datetime import datetime
 from itertools import chain
 from dataclasses import dataclass
-from typing import Protocol, Union, TypeVar
+from typing import Any, Callable, Iterable, List, Optional, Protocol, Union, TypeVar
+from urllib.parse import quote, urlencode
 
 from django.conf import settings
 from django.contrib.sessions.backends.base import SessionBase
-from django.db.models import Model, QuerySet, Q
+from django.core.exceptions import SuspiciousFileOperation
+from django.db.models import Model, QuerySet, Q, prefetch_related_objects
 from django.http import HttpRequest as BaseHttpRequest, HttpResponse, Http404, HttpResponseForbidden
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django.views.static import serve
 
 from justagallery.domain.category import get_display_formats, get_default_thumbnail_format, \
-	get_default_thumbnail_formats, get_default_image, is_private
+	get_default_thumbnail_formats, get_image_display_formats, is_private
 from .domain import entities
-from .domain.image import create_thumbnail, Size
-from . import models
+from .domain.bloom import RotatingBloomFilter
+from . import models, pagecache, search as search_index
+from .counters import count_view
+from .loaders import Cursor, load_category_page, load_image_neighbours
+from .thumbnails import create_missing_thumbnails, get_encoded_path, get_encodings, is_allowed_size, is_current_version, \
+	is_known_missing, is_private_category, remember_missing
 from .domain.url import get_url_by_image, get_category_by_url, get_url_by_category, get_thumbnail_url, get_size_from_str
 
 
@@ -32,10 +44,23 @@ ExtendsQuerySet = TypeVar('ExtendsQuerySet', bound=QuerySet)
 
 logger = logging.getLogger(__name__)
 
+_CONTENT_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}  # of thumbnails by encoding
+
 
 def index(request: HttpRequest) -> HttpResponse:
-	categories = _filter_categories(models.Category.objects.all(), request.user).filter(parent=None).order_by('-created_at').all()
-	return render(request, 'index.html.j2', dict(categories=categories), using='jinja2')
+	private = not request.user.is_anonymous
+	cache_key = pagecache.get_key(request, pagecache.INDEX)
+	if response := _cached_response(request, 'index', private, cache_key):
+		return response
+	categories = list(filter_categories(models.Category.objects.all(), request.user).filter(parent=None).order_by('-created_at'))
+	return conditional_response(
+		request, 'index',
+		private=private,
+		last_modified=max((category.updated_at for category in categories), default=None),
+		etag_parts=[request.user.pk] + [(category.pk, category.updated_at) for category in categories],
+		render_response=lambda: render(request, 'index.html.j2', dict(categories=categories), using='jinja2'),
+		cache_key=cache_key
+	)
 
 
 def category(request: HttpRequest, url) -> HttpResponse:
@@ -62,21 +87,37 @@ def category(request: HttpRequest, url) -> HttpResponse:
 		# So navigating backwards from images or subcategories, won't count.
 		_count_view(category, request.session)
 
+	private = bool(owner) or not request.user.is_anonymous
+	cache_key = pagecache.get_key(request, category.path)
+	if response := _cached_response(request, 'category', private, cache_key):
+		return response
+
 	if category.parent:
 		parent = Item(url=get_url_by_category(category.parent), title=category.parent.title, thumbnail_url='', views=0)
 	else:
 		parent = Item(url='/', title='index', thumbnail_url='', views=0)
+	try:
+		after, before = (Cursor.from_str(request.GET[key]) if key in request.GET else None for key in ('after', 'before'))
+	except ValueError:
+		raise Http404('Page not found')
+	if after and before:
+		raise Http404('Page not found')
+
 	default_thumbnail_format = get_default_thumbnail_format(category)
+	page = load_category_page(category, filter_categories(category.children.all(), request.user),
+		page_size=category.page_size or settings.CATEGORY_PAGE_SIZE, after=after, before=before)
+	if (after or before) and not page.images:
+		raise Http404('Page not found')
 	child_categories = [
 		Item(url=get_url_by_category(child_category), title=child_category.title, views=child_category.views,
-				thumbnail_url=get_thumbnail_url(get_default_image(child_category), default_thumbnail_format)
-					if child_category.images.count() > 0 else '')
-			for child_category in _filter_categories(category.children.all(), request.user)
+				thumbnail_url=get_thumbnail_url(page.covers[child_category.id], default_thumbnail_format)
+					if child_category.id in page.covers else '')
+			for child_category in page.children
 	]
 	images = [
 		Item(url=get_url_by_image(image), title=image.title, views=image.views,
 				thumbnail_url=get_thumbnail_url(image, default_thumbnail_format))
-			for image in category.images.all()
+			for image in page.images
 	]
 
 	template_vars = dict(
@@ -84,8 +125,23 @@ def category(request: HttpRequest, url) -> HttpResponse:
 		parent=parent,
 		child_categories=child_categories,
 		images=images,
+		previous_url=(category_url if page.previous_is_first else '{}?before={}'.format(category_url, page.previous))
+			if page.previous else '',
+		next_url='{}?after={}'.format(category_url, page.next) if page.next else '',
+	)
+	models_shown = [category, *page.children, *page.covers.values(), *page.images]
+	if category.parent:
+		models_shown.append(category.parent)
+	return conditional_response(
+		request, 'category',
+		private=private,
+		last_modified=max(model.updated_at for model in models_shown),
+		etag_parts=[request.user.pk, category.path, parent, child_categories, images, template_vars['previous_url'],
+			page.next,
+			*((model.pk, model.updated_at) for model in models_shown)],
+		render_response=lambda: render(request, 'category.html.j2', template_vars, using='jinja2'),
+		cache_key=cache_key
 	)
-	return render(request, 'category.html.j2', template_vars, using='jinja2')
 
 
 def image(request: HttpRequest, category_slug: str , image_slug: str) -> HttpResponse:
@@ -98,6 +154,9 @@ def image(request: HttpRequest, category_slug: str , image_slug: str) -> HttpRes
 		image = models.Image.objects.get(category=category, slug=image_slug)
 	except models.Image.DoesNotExist:
 		raise Http404('Image not found')
+	image.category = category
+	# shared by the image and its neighbours
+	prefetch_related_objects([category], 'effective_display_formats')
 
 	if owner := is_private(category):
 		if owner != request.user:
@@ -109,35 +168,14 @@ def image(request: HttpRequest, category_slug: str , image_slug: str) -> HttpRes
 		# So navigating backwards from subsizes, won't count.
 		_count_view(image, request.session)
 
-	display_formats = get_display_formats(image)
 	thumbnails = [{
 		'width': df.width,
 		'height': df.height,
 		'crop': df.crop,
 		'thumbnail_url': get_thumbnail_url(image, df),
 		'image_url': get_url_by_image(image, df),
-		} for df in display_formats
-			# filter out thumbnailformats that are larger than or equal to original image.
-			if not (image.width and image.height) or df.width < image.width or df.height < image.height
+		} for df in get_image_display_formats(image)
 	]
-	thumbnails.sort(key=lambda dct: (dct['width'], dct['height'], dct['crop']))
-
-
-	if len(thumbnails) == 0 and image.width and image.height:
-		# No suitable thumbnail formats found. Create one that matches
-		# the original image size.
-		size:int = max(image.width, image.height)
-		df_dct = {
-			'width': size,
-			'height': size,
-			'crop': False,
-		}
-		df_obj: entities.ThumbnailFormat = type('ThumbnailFormat', (entities.ThumbnailFormat,), df_dct)()
-		thumbnails.append({
-			**df_dct,
-			'thumbnail_url': get_thumbnail_url(image, df_obj),
-			'image_url': ''
-		})
 
 	# use parameter-less URL for default (1st) format
 	thumbnails[0]['image_url'] = image_url
@@ -155,67 +193,240 @@ def image(request: HttpRequest, category_slug: str , image_slug: str) -> HttpRes
 		except ValueError:
 			pass
 
+	# links to the neighbours keep the current format, shown if they have it
+	current_format = get_image_display_formats(image)[current_thumbnail_idx] if current_thumbnail_idx else None
+	neighbours = load_image_neighbours(image)
+	navigation = {name: get_url_by_image(neighbour, current_format) if neighbour else ''
+		for name, neighbour in vars(neighbours).items()}
+	prefetch_urls = []
+	if neighbours.next:
+		# the thumbnail the next image is shown with
+		next_formats = get_image_display_formats(neighbours.next)
+		next_format = next((df for df in next_formats if current_format and
+			(df.width, df.height, df.crop) == (current_format.width, current_format.height, current_format.crop)),
+			next_formats[0] if next_formats else None)
+		if next_format:
+			prefetch_urls.append(get_thumbnail_url(neighbours.next, next_format))
+
 	template_vars = dict(
 		image=image,
 		thumbnails=thumbnails,
 		category_url=category_url,
-		current_thumbnail_idx=current_thumbnail_idx
+		current_thumbnail_idx=current_thumbnail_idx,
+		navigation=navigation,
+		prefetch_urls=prefetch_urls,
 	)
-	return render(request, 'image.html.j2', template_vars, using='jinja2')
+	return conditional_response(
+		request, 'image',
+		private=bool(owner) or not request.user.is_anonymous,
+		last_modified=max(image.updated_at, category.updated_at,
+			*(neighbour.updated_at for neighbour in vars(neighbours).values() if neighbour)),
+		etag_parts=[image.pk, image.updated_at, image.views, category_url, thumbnails, current_thumbnail_idx,
+			navigation, prefetch_urls],
+		render_response=lambda: render(request, 'image.html.j2', template_vars, using='jinja2')
+	)
+
+
+def search(request: HttpRequest) -> HttpResponse:
+	""" Search albums and images by the words in the `q' parameter, showing the page in the `page' parameter. """
+	@dataclass
+	class Item:
+		url: str
+		title: str
+		thumbnail_url: str
+
+	query = request.GET.get('q', '').strip()
+	try:
+		page = int(request.GET.get('page', 1))
+	except ValueError:
+		raise Http404('Page not found')
+	results = search_index.search(query, request.user, page, settings.SEARCH_PAGE_SIZE)
+	items = []
+	for result in results.items:
+		if isinstance(result, models.Category):
+			cover, thumbnail_format = result.cover_image, get_default_thumbnail_format(result)
+			items.append(Item(url=get_url_by_category(result), title=result.title,
+				thumbnail_url=get_thumbnail_url(cover, thumbnail_format) if cover and thumbnail_format else ''))
+		else:
+			thumbnail_format = get_default_thumbnail_format(result.category)
+			items.append(Item(url=get_url_by_image(result), title=result.title,
+				thumbnail_url=get_thumbnail_url(result, thumbnail_format) if thumbnail_format else ''))
+
+	def page_url(page: int) -> str:
+		return '/search?{}'.format(urlencode(dict(q=query, page=page)))
+
+	response = render(request, 'search.html.j2', dict(
+		query=query,
+		items=items,
+		previous_url=page_url(page - 1) if page > 1 else '',
+		next_url=page_url(page + 1) if results.has_next else '',
+	), using='jinja2')
+	_patch_cache_control(response, 'search', private=not request.user.is_anonymous)
+	return response
 
 
 def thumbnail(request: HttpRequest, category_id, size, image_slug) -> HttpResponse:
 	path = "{}/{}/{}".format(category_id, size, image_slug)
-	static_serve = lambda: serve(request, path, document_root=settings.THUMBNAILS_ROOT)
 	try:
-		return static_serve()
-	except Http404:
-		try:
-			image = models.Image.objects.get(category_id=int(category_id), slug=image_slug)
-		except models.Image.DoesNotExist:
-			raise Http404('Image not found')
+		file = safe_join(settings.THUMBNAILS_ROOT, path)
+	except SuspiciousFileOperation:
+		raise Http404('Thumbnail not found')
+	encodings = get_encodings()
+	encoding = _get_accepted_encoding(request, encodings)
+	encoded_path, file = get_encoded_path(path, encoding), get_encoded_path(file, encoding)
+	if not os.path.exists(file):
+		# reject unknown thumbnails without queries, as far as possible
+		if is_known_missing(path):
+			raise Http404('Thumbnail not found')
 		try:
 			x, y, crop = get_size_from_str(size)
 		except ValueError:
 			raise Http404('Wrong size')
-		size = Size(x, y)
+		if not is_allowed_size(int(category_id), x, y, crop):
+			raise Http404('Unknown size')
+		try:
+			image = models.Image.objects.get(category_id=int(category_id), slug=image_slug)
+		except models.Image.DoesNotExist:
+			remember_missing(path)
+			raise Http404('Image not found')
 		formats = chain(get_display_formats(image), get_default_thumbnail_formats(image.category))
-		if (size.x, size.y, crop) not in [(dp.width, dp.height, dp.crop) for dp in formats]:
+		if (x, y, crop) not in [(dp.width, dp.height, dp.crop) for dp in formats]:
 			# thumbnail format not defined. Check also if requested format matches original size.
 			if not image.width or not image.height or crop or image.width > x or image.height > y \
 					or (image.width < x and image.height < y):
+				remember_missing(path)
 				raise Http404('Unknown size')
-		create_thumbnail(image.file.path, settings.THUMBNAILS_ROOT / path, size, crop)
-		return static_serve()
+		# create the thumbnails in the other formats of the image as well, while the image is decoded.
+		create_missing_thumbnails(image, models.ThumbnailFormat(width=x, height=y, crop=crop))
+
+	stat = os.stat(file)
+	etag = quote_etag('{:x}-{:x}'.format(stat.st_mtime_ns, stat.st_size))
+	response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+	if response is None:
+		response = _serve_thumbnail(request, encoded_path, file, _CONTENT_TYPES[encoding])
+		response['ETag'] = etag
+		response['Last-Modified'] = http_date(stat.st_mtime)
+	if len(encodings) > 1:
+		patch_vary_headers(response, ('Accept',))
+	# only urls of the current version of the image refer to a thumbnail that never changes
+	current = 'v' in request.GET and is_current_version(int(category_id), image_slug, request.GET['v'])
+	_patch_cache_control(response, 'thumbnail' if current else 'thumbnail_unversioned',
+		is_private_category(int(category_id)))
+	return response
+
+
+def _get_accepted_encoding(request: HttpRequest, encodings: List[str]) -> str:
+	""" The first of the encodings of thumbnails (besides JPEG) the client accepts, JPEG if none. """
+	accepted = set()
+	for media_range in request.headers.get('Accept', '').split(','):
+		media_type, *params = (part.strip() for part in media_range.split(';'))
+		if not any(param.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000') for param in params):
+			accepted.add(media_type.lower())
+	return next((encoding for encoding in encodings if encoding != 'jpeg' and _CONTENT_TYPES[encoding] in accepted),
+		'jpeg')
+
+
+def _serve_thumbnail(request: HttpRequest, path: str, file: str, content_type: str) -> HttpResponse:
+	""" Serve thumbnail file, or let the front-end web server do so if configured. """
+	if settings.THUMBNAILS_SENDFILE:
+		response = HttpResponse(content_type=content_type)
+		if settings.THUMBNAILS_SENDFILE == 'X-Accel-Redirect':
+			response['X-Accel-Redirect'] = settings.THUMBNAILS_ACCEL_REDIRECT_URL + quote(path)
+		else:
+			response[settings.THUMBNAILS_SENDFILE] = file
+		return response
+	response = serve(request, path, document_root=settings.THUMBNAILS_ROOT)
+	# the content type guessed from the slug of the image is the one of the original
+	response['Content-Type'] = content_type
+	return response
+
+
+def conditional_response(request: HttpRequest, view: str, private: bool, last_modified: Optional[datetime],
+		etag_parts: Iterable[Any], render_response: Callable[[], HttpResponse], cache_key: Optional[str] = None) \
+		-> HttpResponse:
+	"""
+		Respond with 304 Not Modified if the client has the current version of the page, otherwise render it.
+		The page is identified by an ETag of everything shown on it, and its last modification time.
+		:param view: name of the view in the CACHE_CONTROL setting
+		:param private: if the page may only be cached by the client
+		:param etag_parts: values which together determine the contents of the page, having a stable repr()
+		:param cache_key: key to store the rendered page with in the page cache, see pagecache.get_key
+	"""
+	etag = quote_etag(hashlib.md5(repr(list(etag_parts)).encode()).hexdigest())
+	timestamp = int(last_modified.timestamp()) if last_modified else None
+	response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+	if response is None:
+		response = render_response()
+		_set_validators(response, etag, timestamp)
+		if cache_key and response.status_code == 200:
+			pagecache.store(cache_key, pagecache.CachedPage(response.content, response['Content-Type'], etag, timestamp))
+	_patch_cache_control(response, view, private)
+	return response
+
+
+def _cached_response(request: HttpRequest, view: str, private: bool, cache_key: Optional[str]) \
+		-> Optional[HttpResponse]:
+	""" Respond with the page from the page cache like conditional_response, if it's cached. """
+	page = pagecache.load(cache_key) if cache_key else None
+	if page is None:
+		return None
+	response = get_conditional_response(request, etag=page.etag, last_modified=page.last_modified)
+	if response is None:
+		response = HttpResponse(page.content, content_type=page.content_type)
+		_set_validators(response, page.etag, page.last_modified)
+	_patch_cache_control(response, view, private)
+	return response
+
+
+def _set_validators(response: HttpResponse, etag: str, timestamp: Optional[int]) -> None:
+	response['ETag'] = etag
+	if timestamp is not None:
+		response['Last-Modified'] = http_date(timestamp)
+
+
+def _patch_cache_control(response: HttpResponse, view: str, private: bool) -> None:
+	""" Add the Cache-Control policy of the view from the CACHE_CONTROL setting to the response. """
+	cache_control = dict(settings.CACHE_CONTROL.get(view, {}))
+	if private:
+		cache_control.pop('public', None)
+		cache_control.pop('s_maxage', None)
+		cache_control['private'] = True
+	patch_cache_control(response, **cache_control)
 
 
 def _count_view(model: ViewsModel, session: SessionBase) -> bool:
 	"""
-		Count view, if not done before in the session of the user.
+		Count view, if not done before in the session of the user. Views are remembered in a Bloom filter
+		of fixed size, so recently seen objects are reliably remembered, and in rare cases a view is not
+		counted as seen before.
 		:return: True if view is counted, False if not
 	"""
-	if 'views' not in session:
-		session['views'] = {}
-
-	model_type = model.__class__.__name__
+	try:
+		seen = RotatingBloomFilter.from_dict(session['seen_views'])
+	except (KeyError, ValueError):
+		seen = RotatingBloomFilter()
 
-	# defaultdict won't serialize, so we must create every item explicitely
-	if model_type not in session['views']:
-		session['views'][model_type] = []
+	if 'views' in session:
+		# migrate sessions from before seen_views, having a list of pks by model type
+		for model_type, pks in session.pop('views').items():
+			for pk in pks:
+				seen.add('{}:{}'.format(model_type, pk))
+		session['seen_views'] = seen.to_dict()
 
-	if model.pk in session['views'][model_type]:
+	model_type = model.__class__.__name__
+	key = '{}:{}'.format(model_type, model.pk)
+	if key in seen:
 		return False
 
-	session['views'][model_type].append(model.pk)
-	session.modified = True
+	seen.add(key)
+	session['seen_views'] = seen.to_dict()
 
+	count_view(model.__class__, model.pk)
 	model.views += 1
-	model.save()
-	logger.debug('Increased views counter for {}({}) to {}'.format(
-		model_type, model.pk, model.views))
+	logger.debug('Counted view of {}({})'.format(model_type, model.pk))
 	return True
 
-def _filter_categories(qs: ExtendsQuerySet, user: entities.User) -> ExtendsQuerySet:
+def filter_categories(qs: ExtendsQuerySet, user: entities.User) -> ExtendsQuerySet:
 	""" Filter query for categories to be shown """
 	q = Q(hidden=False, private=False)
 	if user and not user.is_anonymous: